@@ -1,5 +1,6 @@
 from .connection import *
 from .errors import *
+from .polling import *
 from .relation import *
 from .query import *
 from .schema import *
@@ -1,23 +1,49 @@
 #!/usr/bin/env python
 
 import argparse
+import glob
 import json
 import logging
 import locale
+import os
 import sys
+import time
 import cStringIO
+import datetime
+from itertools import islice
+from multiprocessing import Pool, cpu_count
 from struct import Struct
+from uuid import uuid4
 
 import unicodecsv as csv
 from messytables import (any_tableset, headers_guess, headers_processor,
                          offset_processor, type_guess, types_processor)
-from messytables import (StringType, IntegerType, DecimalType)
+from messytables import (StringType, IntegerType, DecimalType, BoolType,
+                         DateType)
 
 import myria
+from myria.errors import MyriaError
+from myria.schema import NUMERIC_TYPES, STRUCT_FORMATS
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
 
 # Set the log level here
 logging.getLogger().setLevel(logging.INFO)
 
+# Bytes of stdin buffered so that the types can be guessed from a sample
+SAMPLE_SIZE = 1 << 20
+# Rows converted at a time into each chunk of the upload
+ROWS_PER_CHUNK = 4096
+
+# The prefix of a string in the binary encoding: its length in bytes
+STRING_LENGTH = Struct('<i')
+# Datetimes are encoded as milliseconds since the (UTC) epoch
+DATETIME = Struct('<q')
+EPOCH = datetime.datetime(1970, 1, 1)
+
 
 def pretty_json(obj):
     return json.dumps(obj, indent=4, separators=(',', ': '))
@@ -53,8 +79,14 @@ def parse_args(argv=None):
                         dest="ssl", action="store_false")
     parser.set_defaults(ssl=True)
 
-    parser.add_argument('file', help="File to be uploaded (default: stdin)",
-                        nargs='?', type=argparse.FileType('rb'))
+    parser.add_argument('files', metavar='file',
+                        help="Files, directories or glob patterns to be "
+                             "uploaded into the relation (default: stdin)",
+                        nargs='*')
+    parser.add_argument('--jobs', '-j',
+                        help="Number of files converted and uploaded in "
+                             "parallel (default: number of cores)",
+                        type=int, default=cpu_count())
 
     def set_locale(name):
         try:
@@ -70,10 +102,16 @@ def parse_args(argv=None):
                         type=set_locale)
 
     parser.add_argument('--overwrite', '-o',
-                        help="Overwrite existing data (default: False)",
+                        help="Overwrite existing data (default: False); "
+                             "several files are otherwise appended",
                         action='store_true', default=False)
     parser.add_argument('--dry', '-d', help="Output parsed results to stdout",
                         action='store_true', default=False)
+    parser.add_argument('--binary', '-b',
+                        help="Upload tables containing strings, booleans or "
+                             "dates in binary rather than CSV (default: only "
+                             "numeric tables)",
+                        action='store_true', default=False)
 
     parser.add_argument('--user',
                         help="User who owns the relation (default:public)",
@@ -84,7 +122,48 @@ def parse_args(argv=None):
     parser.add_argument('--relation', help="Relation name",
                         type=str, required=True)
 
-    return parser.parse_args(argv)
+    args = parser.parse_args(argv)
+    try:
+        args.files = expand_paths(args.files)
+    except IOError as e:
+        parser.error(str(e))
+    return args
+
+
+def expand_paths(paths):
+    """Replace directories by the files they contain, and glob patterns by
+    the files they match"""
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            names = sorted(name for name in os.listdir(path)
+                           if not name.startswith('.'))
+            files.extend(os.path.join(path, name) for name in names
+                         if os.path.isfile(os.path.join(path, name)))
+        elif os.path.isfile(path):
+            files.append(path)
+        else:
+            matches = sorted(match for match in glob.glob(path)
+                             if os.path.isfile(match))
+            if not matches:
+                raise IOError('No such file: {}'.format(path))
+            files.extend(matches)
+    return files
+
+
+class BooleanType(BoolType):
+    """A boolean field, matching true/false and yes/no but, unlike BoolType,
+    leaving 0/1 to be guessed as integers."""
+    true_values = ('yes', 'true')
+    false_values = ('no', 'false')
+
+
+def guess_types(binary=False):
+    """The MessyTables types to guess among. Dates and booleans are only
+    guessed for the binary encoding, which can represent them."""
+    if binary:
+        return [StringType, DecimalType, IntegerType, BooleanType, DateType]
+    return [StringType, DecimalType, IntegerType]
 
 
 def convert_type(type_):
@@ -95,6 +174,10 @@ def convert_type(type_):
         return "LONG_TYPE"
     elif isinstance(type_, DecimalType):
         return "DOUBLE_TYPE"
+    elif isinstance(type_, BoolType):
+        return "BOOLEAN_TYPE"
+    elif isinstance(type_, DateType):
+        return "DATETIME_TYPE"
 
 
 def messy_to_schema(types, headers=None):
@@ -121,51 +204,179 @@ def args_to_relation_key(args):
 
 def type_fmt(type_):
     """Return the Python struct marker for the type"""
-    if type_ == 'INT_TYPE':
-        return 'i'
-    elif type_ == 'LONG_TYPE':
-        return 'q'
-    elif type_ == 'FLOAT_TYPE':
-        return 'f'
-    elif type_ == 'DOUBLE_TYPE':
-        return 'd'
+    if type_ in STRUCT_FORMATS:
+        return STRUCT_FORMATS[type_]
     raise NotImplementedError('type {} is not supported'.format(type_))
 
 
-def write_binary(row_set, schema, output):
+class SampledStream(object):
+    """A file-like view of an unseekable stream (such as stdin) that buffers
+    only the first sample_size bytes. The sample may be re-read, as type
+    guessing does, after which the rest of the stream is read through."""
+
+    def __init__(self, fp, sample_size=SAMPLE_SIZE):
+        self.fp = fp
+        self.sample = fp.read(sample_size)
+        self.offset = 0
+
+    def seek(self, offset, whence=0):
+        if whence != 0 or self.offset > len(self.sample) or \
+                offset > len(self.sample):
+            raise IOError('Can only seek within the first {} bytes'
+                          .format(len(self.sample)))
+        self.offset = offset
+
+    def tell(self):
+        return self.offset
+
+    def read(self, n=-1):
+        data = self.sample[self.offset:] if n < 0 else \
+            self.sample[self.offset:self.offset + n]
+        if n < 0 or len(data) < n:
+            data += self.fp.read(-1 if n < 0 else n - len(data))
+        self.offset += len(data)
+        return data
+
+    def readline(self):
+        end = self.sample.find('\n', self.offset) + 1 or len(self.sample)
+        line = self.sample[self.offset:end]
+        if not line.endswith('\n'):
+            line += self.fp.readline()
+        self.offset += len(line)
+        return line
+
+    def __iter__(self):
+        return iter(self.readline, '')
+
+
+def iter_rows(row_set, rows_per_chunk=ROWS_PER_CHUNK):
+    """Generate the rows of a row_set in lists of values, one list for
+    each chunk of the upload"""
+    rows = iter(row_set)
+    while True:
+        chunk = [[cell.value for cell in row]
+                 for row in islice(rows, rows_per_chunk)]
+        if not chunk:
+            return
+        yield chunk
+
+
+def encode_block(rows, dtype):
+    """Parse a block of rows of numeric strings into typed columns and
+    return them packed as records of the (little-endian) dtype"""
+    values = numpy.array(rows)
+    if values.ndim != 2 or values.shape[1] != len(dtype.names):
+        raise ValueError('Rows do not all have {} columns'
+                         .format(len(dtype.names)))
+
+    records = numpy.empty(len(rows), dtype=dtype)
+    for i, name in enumerate(dtype.names):
+        records[name] = values[:, i].astype(dtype[name])
+    return records.tobytes()
+
+
+def write_binary(row_set, schema, types=None):
+    """Generate the rows of row_set as packed binary chunks. If the types
+    are given, the rows have not yet been cast to them, and are parsed a
+    block at a time using numpy when it is available."""
     column_types = schema['columnTypes']
     desc = '<' + ''.join(type_fmt(type_) for type_ in column_types)
     logging.info("Creating a binary file with struct.fmt={}".format(desc))
 
     struct = Struct(desc)
-    for row in row_set:
-        vals = [cell.value for cell in row]
-        output.write(struct.pack(*vals))
+    if types is None or numpy is None:
+        if types is not None:
+            row_set.register_processor(types_processor(types))
+        for rows in iter_rows(row_set):
+            yield ''.join(struct.pack(*vals) for vals in rows)
+        return
 
+    dtype = numpy.dtype([('f{}'.format(i), '<' + type_fmt(type_))
+                         for i, type_ in enumerate(column_types)])
+    for rows in iter_rows(row_set):
+        try:
+            yield encode_block(rows, dtype)
+        except (ValueError, OverflowError):
+            # e.g., locale-specific numbers; cast this block cell by cell
+            yield ''.join(struct.pack(*[type_.cast(value) for type_, value
+                                        in zip(types, vals)])
+                          for vals in rows)
+
+
+def encode_string(value):
+    """Encode a string as its UTF-8 length followed by its UTF-8 bytes"""
+    if isinstance(value, unicode):
+        value = value.encode('utf-8')
+    return STRING_LENGTH.pack(len(value)) + value
+
+
+def encode_datetime(value):
+    """Encode a (naive, UTC) datetime as milliseconds since the epoch"""
+    delta = value - EPOCH
+    return DATETIME.pack((delta.days * 86400 + delta.seconds) * 1000 +
+                         delta.microseconds // 1000)
+
+
+def record_encoder(schema):
+    """Return a function that packs a row of values of the schema into a
+    little-endian binary record, of any column types"""
+    encoders = []
+    for type_ in schema['columnTypes']:
+        if type_ == 'STRING_TYPE':
+            encoders.append(encode_string)
+        elif type_ == 'DATETIME_TYPE':
+            encoders.append(encode_datetime)
+        else:
+            encoders.append(Struct('<' + type_fmt(type_)).pack)
+
+    def encode(values):
+        return ''.join(encoder(value)
+                       for encoder, value in zip(encoders, values))
+    return encode
+
+
+def write_records(row_set, schema, types=None):
+    """Generate the rows of row_set as binary records of any column types,
+    in chunks"""
+    logging.info("Creating a binary file with types {}"
+                 .format(', '.join(schema['columnTypes'])))
+    if types is not None:
+        row_set.register_processor(types_processor(types))
+    encode = record_encoder(schema)
+    for rows in iter_rows(row_set):
+        yield ''.join(encode(vals) for vals in rows)
 
-def write_plaintext(row_set, output):
+
+def write_plaintext(row_set, types=None):
     logging.info("Creating a plaintext file")
-    writer = csv.writer(output)
-    for row in row_set:
-        writer.writerow([r.value for r in row])
+    if types is not None:
+        row_set.register_processor(types_processor(types))
+    for rows in iter_rows(row_set):
+        output = cStringIO.StringIO()
+        csv.writer(output).writerows(rows)
+        yield output.getvalue()
 
 
-def write_data(row_set, schema):
+def write_data(row_set, schema, types=None, binary=False):
     """Given a row_set and schema, return (data, kwargs) for sending
-    to Myria."""
-    output = cStringIO.StringIO()
-
-    if all(type_ in ['INT_TYPE', 'LONG_TYPE', 'FLOAT_TYPE', 'DOUBLE_TYPE']
-           for type_ in schema['columnTypes']):
+    to Myria, where data generates the converted file in chunks. If the
+    messytables types are given, the rows of row_set are cast to them
+    as they are converted. Numeric tables are always sent in binary, and
+    other tables too if binary is True."""
+    if all(type_ in NUMERIC_TYPES for type_ in schema['columnTypes']):
         # File is binary
-        write_binary(row_set, schema, output)
+        data = write_binary(row_set, schema, types)
+        kwargs = {'binary': True, 'is_little_endian': True}
+    elif binary:
+        # File is binary, including variable-width strings
+        data = write_records(row_set, schema, types)
         kwargs = {'binary': True, 'is_little_endian': True}
     else:
         # File is plaintext
-        write_plaintext(row_set, output)
+        data = write_plaintext(row_set, types)
         kwargs = {}
 
-    return output.getvalue(), kwargs
+    return data, kwargs
 
 
 def strip_processor():
@@ -179,6 +390,14 @@ def strip_processor():
     return apply_replace
 
 
+def count_processor(counter):
+    """count the rows that are read"""
+    def count(row_set, row):
+        counter[0] += 1
+        return row
+    return count
+
+
 def replace_empty_string(sample):
     """replace empty strings with a non empty string to force
     type guessing to use string"""
@@ -189,17 +408,11 @@ def replace_empty_string(sample):
     return [[replace(cell) for cell in row] for row in sample]
 
 
-def main(argv=None):
-    args = parse_args(argv)
-
-    if args.file is None:
-        # slurp the whole input since there seems to be a bug in messytables
-        # which should be able to handle streams but doesn't
-        args.file = cStringIO.StringIO(sys.stdin.read())
-
-    relation_key = args_to_relation_key(args)
-
-    table_set = any_tableset(args.file)
+def load_row_set(fp, types=None, binary=False):
+    """Open the single table in fp and guess its header and, unless they are
+    given, the types of its columns. Return (row_set, types, headers), where
+    headers is None if the table has no header."""
+    table_set = any_tableset(fp)
     if len(table_set.tables) != 1:
         raise ValueError("Can only handle files with a single table, not %s"
                          % len(table_set.tables))
@@ -213,10 +426,13 @@ def main(argv=None):
     # Temporarily, mark the offset of the header
     row_set.register_processor(offset_processor(offset + 1))
 
-    # guess types and register them
-    types = type_guess(replace_empty_string(row_set.sample), strict=True,
-                       types=[StringType, DecimalType, IntegerType])
-    row_set.register_processor(types_processor(types))
+    # guess types, which are applied as the data is written
+    if types is None:
+        types = type_guess(replace_empty_string(row_set.sample), strict=True,
+                           types=guess_types(binary))
+    elif len(headers) != len(types):
+        raise ValueError("Expected {} columns, not {}"
+                         .format(len(types), len(headers)))
 
     # Messytables seems to not handle the case where there are no headers.
     # Work around this as follows:
@@ -232,15 +448,134 @@ def main(argv=None):
             # We don't need the headers_processor or the offset_processor
             row_set._processors = []
             row_set.register_processor(strip_processor())
-            row_set.register_processor(types_processor(types))
             headers = None
 
+    return row_set, types, headers
+
+
+def convert_file(fp, schema, types, binary=False):
+    """Convert an open file that should match the schema (and messytables
+    types) guessed from another file. Return (data, kwargs, rows), where rows
+    counts the rows as data is generated; fp must stay open until data has
+    been consumed."""
+    row_set, _, headers = load_row_set(fp, types)
+    if headers is not None and \
+            messy_to_schema(types, headers) != schema:
+        raise ValueError("The header of {} does not match the schema {}"
+                         .format(fp.name, json.dumps(schema)))
+
+    rows = [0]
+    row_set.register_processor(count_processor(rows))
+    data, kwargs = write_data(row_set, schema, types, binary)
+    return data, kwargs, rows
+
+
+def upload_part(job):
+    """Convert a file and upload it into a staging relation, returning the
+    number of rows and bytes uploaded. Run in a worker process."""
+    path, part_key, schema, types, binary, server = job
+    hostname, port, ssl = server
+    connection = myria.MyriaConnection(hostname=hostname, port=port, ssl=ssl)
+    sent = [0]
+
+    with open(path, 'rb') as fp:
+        data, kwargs, rows = convert_file(fp, schema, types, binary)
+
+        def count_bytes():
+            for chunk in data:
+                sent[0] += len(chunk)
+                yield chunk
+
+        connection.upload_file(part_key, schema, count_bytes(),
+                               overwrite=True, **kwargs)
+    logging.info("Uploaded {} to {}".format(path, part_key['relationName']))
+    return rows[0], sent[0]
+
+
+def upload_files(args, relation_key):
+    """Upload several files, which share the schema guessed from the first,
+    into the relation. Each file is converted and uploaded into a staging
+    relation by a pool of processes, then the parts are committed together.
+    """
+    with open(args.files[0], 'rb') as fp:
+        _, types, headers = load_row_set(fp, binary=args.binary)
+    schema = messy_to_schema(types, headers)
+    logging.info("Myria schema: {}".format(json.dumps(schema)))
+
+    if args.dry:
+        for path in args.files:
+            with open(path, 'rb') as fp:
+                data, _, _ = convert_file(fp, schema, types, args.binary)
+                for chunk in data:
+                    sys.stdout.write(chunk)
+        return
+
+    token = uuid4().hex[:8]
+    parts = [dict(relation_key, relationName='{}__part_{}_{}'.format(
+        relation_key['relationName'], token, i))
+        for i in range(len(args.files))]
+    server = (args.hostname, args.port, args.ssl)
+    jobs = [(path, part_key, schema, types, args.binary, server)
+            for path, part_key in zip(args.files, parts)]
+
+    connection = myria.MyriaConnection(
+        hostname=args.hostname, port=args.port, ssl=args.ssl)
+    start = time.time()
+    committed = False
+    try:
+        if args.jobs > 1:
+            pool = Pool(min(args.jobs, len(jobs)))
+            try:
+                results = pool.map(upload_part, jobs)
+            finally:
+                pool.close()
+                pool.join()
+        else:
+            results = map(upload_part, jobs)
+
+        ret = connection.commit_parts(relation_key, parts, args.overwrite)
+        committed = True
+    finally:
+        if not committed:
+            # Remove the staging relations of the failed upload, some of
+            # which may never have been created
+            for part_key in parts:
+                try:
+                    connection.delete_dataset(part_key)
+                except MyriaError:
+                    pass
+    elapsed = max(time.time() - start, 1e-6)
+
+    rows = sum(count for count, _ in results)
+    sent = sum(size for _, size in results)
+    logging.info("Uploaded {} rows ({} bytes) from {} files in {:.2f}s: "
+                 "{:.0f} rows/s, {:.0f} bytes/s".format(
+                     rows, sent, len(args.files), elapsed,
+                     rows / elapsed, sent / elapsed))
+    sys.stdout.write(pretty_json(ret))
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    relation_key = args_to_relation_key(args)
+
+    if len(args.files) > 1:
+        return upload_files(args, relation_key)
+    elif args.files:
+        fp = open(args.files[0], 'rb')
+    else:
+        # messytables re-reads the start of its input while guessing, so
+        # buffer a sample of stdin and stream the remainder
+        fp = SampledStream(sys.stdin)
+
+    row_set, types, headers = load_row_set(fp, binary=args.binary)
+
     # Construct the Myria schema
     schema = messy_to_schema(types, headers)
     logging.info("Myria schema: {}".format(json.dumps(schema)))
 
     # Prepare data for writing to Myria
-    data, kwargs = write_data(row_set, schema)
+    data, kwargs = write_data(row_set, schema, types, args.binary)
 
     if not args.dry:
         # Connect to Myria and send the data
@@ -251,4 +586,5 @@ def main(argv=None):
 
         sys.stdout.write(pretty_json(ret))
     else:
-        sys.stdout.write(data)
+        for chunk in data:
+            sys.stdout.write(chunk)
@@ -1,18 +1,49 @@
 import base64
+import codecs
 import ConfigParser
+import copy
 import json
 import csv
-from time import sleep
+import hashlib
+from itertools import chain, islice
 import logging
+import os
+import socket
+import struct
+import time
+import zlib
+from multiprocessing.pool import ThreadPool
+from Queue import Queue, Full
+from StringIO import StringIO
+from threading import BoundedSemaphore, Event, Lock
 from urlparse import urlparse, ParseResult
+from uuid import uuid4
 
 import requests
+from requests.adapters import HTTPAdapter
+from requests.exceptions import ContentDecodingError
+from requests.utils import super_len
+from urllib3.connection import HTTPConnection
+from urllib3.fields import RequestField
 
 from raco.backends.myria.connection \
     import MyriaConnection as RacoMyriaConnection
 from .errors import MyriaError
+from .plans import get_union_plan
+from .polling import PollingStrategy, RetryPolicy
+from .schema import DTYPES, NUMERIC_TYPES, STRUCT_FORMATS
 
-__all__ = ['MyriaConnection']
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+try:
+    import pandas
+except ImportError:
+    pandas = None
+
+__all__ = ['MyriaConnection', 'MyriaAsyncConnection']
 
 # String constants used in forming requests
 JSON = 'application/json'
@@ -20,11 +51,252 @@ CSV = 'text/plain'
 GET = 'GET'
 PUT = 'PUT'
 POST = 'POST'
+DELETE = 'DELETE'
+
+# Size of the chunks read from the socket when streaming a response
+CHUNK_SIZE = 64 * 1024
+
+# Number of threads in the pool shared by asynchronous requests
+DEFAULT_CONCURRENCY = 32
+
+# Content encodings that may be applied to request bodies, and the smallest
+# (in-memory) body worth compressing
+COMPRESSIONS = ['gzip']
+COMPRESSION_LEVEL = 6
+COMPRESSION_THRESHOLD = 1024
+
+# Seconds for which relation metadata is reused before being fetched again
+METADATA_TTL = 60
 
 # Enable or configure logging
 logging.basicConfig(level=logging.WARN)
 
 
+def _iter_json_array(chunks):
+    """Incrementally decode the elements of a JSON array.
+
+    Args:
+        chunks: an iterable of (UTF-8 encoded) fragments of a JSON array.
+
+    Each element is yielded as soon as it has been completely received, so
+    only the undecoded tail of the input is held in memory.
+    """
+    decoder = json.JSONDecoder()
+    text_decoder = codecs.getincrementaldecoder('utf-8')()
+    chunks = iter(chunks)
+    buf = u''
+    pos = 0
+    started = False
+    exhausted = False
+
+    while True:
+        while pos < len(buf) and buf[pos] in ' \t\r\n,':
+            pos += 1
+
+        if pos < len(buf) and not started:
+            if buf[pos] != '[':
+                raise ValueError('Expected a JSON array')
+            started = True
+            pos += 1
+            continue
+        elif pos < len(buf) and buf[pos] == ']':
+            return
+        elif pos < len(buf):
+            try:
+                value, end = decoder.raw_decode(buf, pos)
+            except ValueError:
+                if exhausted:
+                    raise
+            else:
+                # A number at the very end of the buffer may continue in
+                # the next chunk, so only accept it once more data arrives
+                if end < len(buf) or exhausted:
+                    yield value
+                    pos = end
+                    continue
+        elif exhausted:
+            raise ValueError('Unexpected end of JSON array')
+
+        # Need more data: drop the consumed prefix and read the next chunk
+        buf = buf[pos:]
+        pos = 0
+        try:
+            buf += text_decoder.decode(next(chunks))
+        except StopIteration:
+            buf += text_decoder.decode('', final=True)
+            exhausted = True
+
+
+def _iter_batches(iterable, batch_size):
+    """Group the values of an iterable into lists of at most batch_size"""
+    iterator = iter(iterable)
+    while True:
+        batch = list(islice(iterator, batch_size))
+        if not batch:
+            return
+        yield batch
+
+
+class _ChunkReader(object):
+    """A read-only file-like object over an iterable of byte strings"""
+
+    def __init__(self, chunks):
+        self._chunks = iter(chunks)
+        self._buffer = ''
+
+    def read(self, size=-1):
+        parts, length = [self._buffer], len(self._buffer)
+        while size < 0 or length < size:
+            chunk = next(self._chunks, None)
+            if chunk is None:
+                break
+            parts.append(chunk)
+            length += len(chunk)
+        data = ''.join(parts)
+        if size < 0:
+            size = len(data)
+        self._buffer = data[size:]
+        return data[:size]
+
+    def __iter__(self):
+        return iter(self.read().splitlines(True))
+
+
+def _parse_csv_array(chunks, names, dtype):
+    """Parse numeric CSV data, given as an iterable of chunks of bytes,
+    into a NumPy structured array. A header line matching the names is
+    skipped."""
+    chunks = iter(chunks)
+    head = ''
+    while '\n' not in head:
+        chunk = next(chunks, None)
+        if chunk is None:
+            break
+        head += chunk
+    first = head.split('\n', 1)[0]
+    if [f.strip() for f in first.split(',')] == names:
+        head = head[len(first) + 1:]
+    chunks = chain([head], chunks)
+
+    if pandas is None:
+        return numpy.loadtxt(_ChunkReader(chunks), delimiter=',', ndmin=1,
+                             dtype=dtype)
+
+    # The C parser of pandas is much faster than numpy.loadtxt
+    try:
+        frame = pandas.read_csv(_ChunkReader(chunks), header=None,
+                                names=dtype.names, dtype=dict(
+                                    (name, dtype[name])
+                                    for name in dtype.names))
+    except pandas.errors.EmptyDataError:
+        return numpy.zeros(0, dtype=dtype)
+    array = numpy.empty(len(frame), dtype=dtype)
+    for name in dtype.names:
+        array[name] = frame[name].values
+    return array
+
+
+def _compress(chunks, count):
+    """Generate the gzip compression of an iterable of chunks, calling count
+    with the number of bytes before and after compressing each chunk"""
+    compressor = zlib.compressobj(COMPRESSION_LEVEL, zlib.DEFLATED,
+                                  16 + zlib.MAX_WBITS)
+    for chunk in chunks:
+        compressed = compressor.compress(chunk)
+        count(len(chunk), len(compressed))
+        if compressed:
+            yield compressed
+    compressed = compressor.flush()
+    count(0, len(compressed))
+    yield compressed
+
+
+def _decompress(chunks, encoding, count):
+    """Generate the decoding of an iterable of chunks of a response body with
+    the given Content-Encoding, calling count with the number of bytes after
+    and before decoding each chunk"""
+    if encoding == 'gzip':
+        decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+    elif encoding == 'deflate':
+        decompressor = zlib.decompressobj()
+    else:
+        decompressor = None
+
+    try:
+        for chunk in chunks:
+            data = decompressor.decompress(chunk) if decompressor else chunk
+            count(len(data), len(chunk))
+            if data:
+                yield data
+        if decompressor:
+            data = decompressor.flush()
+            count(len(data), 0)
+            if data:
+                yield data
+    except zlib.error as e:
+        raise ContentDecodingError(e)
+
+
+_default_pool = None
+_default_pool_lock = Lock()
+
+
+def _get_default_pool():
+    """Return the thread pool shared by asynchronous requests"""
+    global _default_pool
+    with _default_pool_lock:
+        if _default_pool is None:
+            _default_pool = ThreadPool(DEFAULT_CONCURRENCY)
+        return _default_pool
+
+
+class _KeepAliveAdapter(HTTPAdapter):
+    """An HTTP adapter whose pooled connections enable TCP keep-alive"""
+
+    def init_poolmanager(self, *args, **kwargs):
+        kwargs['socket_options'] = HTTPConnection.default_socket_options + [
+            (socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)]
+        super(_KeepAliveAdapter, self).init_poolmanager(*args, **kwargs)
+
+
+class _MultipartStream(object):
+    """A multipart/form-data request body containing fields whose data may
+    be an iterable of byte chunks of unknown total length; requests sends it
+    with chunked transfer encoding. Like MultipartEncoder, it exposes the
+    fields that it encodes."""
+
+    def __init__(self, fields, progress=None):
+        self.fields = fields
+        self.boundary = uuid4().hex
+        self.content_type = 'multipart/form-data; boundary={}'.format(
+            self.boundary)
+        self.progress = progress
+
+    def _iter_parts(self):
+        for name, (filename, data, content_type) in self.fields:
+            field = RequestField(name, '', filename=filename)
+            field.make_multipart(content_type=content_type)
+            yield '--{}\r\n'.format(self.boundary)
+            yield field.render_headers().encode('utf-8')
+            if isinstance(data, basestring):
+                yield data
+            else:
+                for chunk in data:
+                    yield chunk
+            yield '\r\n'
+        yield '--{}--\r\n'.format(self.boundary)
+
+    def __iter__(self):
+        sent = 0
+        for chunk in self._iter_parts():
+            # an empty chunk would end a chunked request prematurely
+            if chunk:
+                sent += len(chunk)
+                yield chunk
+                if self.progress is not None:
+                    self.progress(sent, None)
+
+
 class MyriaConnection(object):
     """Contains a connection the Myria REST server."""
 
@@ -53,7 +325,13 @@ class MyriaConnection(object):
                  ssl=False,
                  rest_url=None,
                  execution_url=None,
-                 timeout=None):
+                 timeout=None,
+                 polling=None,
+                 retry=None,
+                 pool_connections=10,
+                 pool_maxsize=DEFAULT_CONCURRENCY,
+                 compression=None,
+                 metadata_ttl=METADATA_TTL):
         """Initializes a connection to the Myria REST server.
            (And optionally a Myria program execution URI.)
 
@@ -65,12 +343,38 @@ class MyriaConnection(object):
                 deployment is provided.
             port: The port of the REST server. May be overwritten if deployment
                 is provided.
-            timeout: The timeout for the connection to myria.
+            timeout: The timeout, in seconds, applied to every request to
+                myria. Either a number or a (connect, read) tuple; None
+                waits indefinitely.
 
             rest_url: a URL pointing to a Myria REST endpoint
             execution_url: a URL pointing to a Myria webserver for program
                 execution
+            polling: the PollingStrategy used to wait for asynchronous
+                requests and queries to complete. Defaults to exponential
+                backoff starting at 50 ms.
+            retry: the RetryPolicy applied to requests that fail with a
+                connection error or transient server error. Only idempotent
+                requests (status polls, metadata and downloads) are retried.
+            pool_connections: the number of connection pools to cache.
+            pool_maxsize: the maximum number of connections kept alive in
+                each pool. Should be at least the number of threads that
+                share this connection.
+            compression: optional content encoding ('gzip') with which the
+                bodies of uploads and submitted plans are compressed, as
+                they are sent. The server must accept this encoding.
+                Responses are decoded according to their Content-Encoding
+                either way, and transfer_stats counts both sizes.
+            metadata_ttl: the number of seconds for which relation metadata
+                fetched by dataset() is cached and reused. Writes made
+                through this connection invalidate it immediately; writes
+                made by other clients are only seen once it expires. Zero
+                or None disables the cache.
         """
+        if compression not in [None] + COMPRESSIONS:
+            raise ValueError('Unsupported compression: {}'.format(
+                compression))
+
         # Parse the deployment file and, if present, override the hostname and
         # port with any provided values from deployment.
         rest_config = self._parse_deployment(deployment)
@@ -95,23 +399,157 @@ class MyriaConnection(object):
                                         query="", fragment="").geturl()
 
         self._url_start = '{}://{}:{}'.format(uri_scheme, hostname, port)
+        self.timeout = timeout
         self._session = requests.Session()
         self._session.headers.update(self._DEFAULT_HEADERS)
+        adapter = _KeepAliveAdapter(pool_connections=pool_connections,
+                                    pool_maxsize=pool_maxsize)
+        self._session.mount('http://', adapter)
+        self._session.mount('https://', adapter)
         self.execution_url = execution_url
+        self.polling = polling or PollingStrategy()
+        self.retry = retry or RetryPolicy()
+        self.compression = compression
+
+        self._transfer_lock = Lock()
+        self._transfer = {'sent': 0, 'sent_compressed': 0,
+                          'received': 0, 'received_compressed': 0}
+        self._session.hooks['response'].append(self._count_response)
+
+        self.metadata_ttl = metadata_ttl
+        self._metadata_lock = Lock()
+        self._metadata = {}
+        self._cache = {'hits': 0, 'misses': 0}
+        self.catalog_version = 0
+
+    @property
+    def transfer_stats(self):
+        """Bytes sent and received by this connection, both before
+        ('sent', 'received') and after ('sent_compressed',
+        'received_compressed') content encoding is applied. Bodies of
+        unknown length are only counted when compressed."""
+        with self._transfer_lock:
+            return dict(self._transfer)
+
+    @property
+    def cache_stats(self):
+        """The number of calls to dataset() answered from the metadata cache
+        ('hits') and from the server ('misses')"""
+        with self._metadata_lock:
+            return dict(self._cache, size=len(self._metadata))
+
+    @staticmethod
+    def _metadata_key(relation_key):
+        return (relation_key['userName'],
+                relation_key['programName'],
+                relation_key['relationName'])
+
+    def cache_metadata(self, relation_key, metadata):
+        """Record the metadata of a relation, such as that listed after a
+        query completes, so that dataset() need not fetch it"""
+        if self.metadata_ttl:
+            with self._metadata_lock:
+                self._metadata[self._metadata_key(relation_key)] = \
+                    (time.time() + self.metadata_ttl, metadata)
+
+    def invalidate_metadata(self, relation_key=None):
+        """Discard the cached metadata of a relation, or of every relation
+        when none is given, and advance catalog_version so that anything
+        derived from the catalog (e.g., compiled plans) is rebuilt"""
+        with self._metadata_lock:
+            if relation_key is None:
+                self._metadata.clear()
+            else:
+                self._metadata.pop(self._metadata_key(relation_key), None)
+            self.catalog_version += 1
+
+    def _count_sent(self, size, compressed):
+        with self._transfer_lock:
+            self._transfer['sent'] += size
+            self._transfer['sent_compressed'] += compressed
+
+    def _count_received(self, size, compressed):
+        with self._transfer_lock:
+            self._transfer['received'] += size
+            self._transfer['received_compressed'] += compressed
+
+    def _count_response(self, r, *args, **kwargs):
+        """Decode (and count) the body of a response as it is read"""
+        raw = getattr(r, 'raw', None)
+        if hasattr(raw, 'stream'):
+            stream = raw.stream
+            encoding = r.headers.get('Content-Encoding', '').lower()
+
+            def decoded_stream(amt=CHUNK_SIZE, decode_content=None):
+                return _decompress(stream(amt, decode_content=False),
+                                   encoding, self._count_received)
+            raw.stream = decoded_stream
+        return r
+
+    def _encode_body(self, data, headers):
+        """Compress a request body with the content encoding of this
+        connection, streaming file-like objects and iterables"""
+        if isinstance(data, unicode):
+            data = data.encode('utf-8')
+        if isinstance(data, str):
+            if len(data) < COMPRESSION_THRESHOLD:
+                self._count_sent(len(data), len(data))
+                return data, headers
+            chunks = [data]
+        elif hasattr(data, 'read'):
+            chunks = iter(lambda: data.read(CHUNK_SIZE), b'')
+        else:
+            chunks = data
+
+        headers = dict(headers or {})
+        headers['Content-Encoding'] = self.compression
+        body = _compress(chunks, self._count_sent)
+        # Send compressed bytes with a Content-Length, and streams chunked
+        return (b''.join(body) if isinstance(data, str) else body), headers
+
+    def _request(self, method, url, **kwargs):
+        """Issue a request over the pooled session, applying the timeout and
+        (for idempotent methods) the retry policy of this connection"""
+        if '://' not in url:
+            url = self._url_start + url
+        kwargs.setdefault('timeout', self.timeout)
+        if kwargs.get('data') is not None and method in (POST, PUT):
+            if self.compression:
+                kwargs['data'], kwargs['headers'] = self._encode_body(
+                    kwargs['data'], kwargs.get('headers'))
+            else:
+                size = super_len(kwargs['data'])
+                self._count_sent(size, size)
+        attempt = self.retry.start() \
+            if self.retry.is_idempotent(method) else None
+        while True:
+            try:
+                r = self._session.request(method, url, **kwargs)
+            except (requests.ConnectionError, requests.Timeout):
+                if attempt is None or not attempt.retry():
+                    raise
+                continue
+            if attempt is not None and \
+                    r.status_code in self.retry.statuses and \
+                    attempt.retry(r.headers.get('Retry-After')):
+                r.close()
+                continue
+            return r
 
     def _finish_async_request(self, method, url, body=None, accept=JSON):
         headers = {
             'Accept': accept
         }
+        poller = self.polling.start()
         try:
             while True:
                 if '://' not in url:
                     url = self._url_start + url
                 logging.info("Finish async request to {}. Headers: {}".format(
                     url, headers))
-                r = self._session.request(method, url, headers=headers,
-                                          data=body)
+                r = self._request(method, url, headers=headers, data=body)
                 if r.status_code in [200, 201]:
+                    poller.finish()
                     if accept == JSON:
                         return r.json()
                     else:
@@ -121,10 +559,9 @@ class MyriaConnection(object):
                     url = r.headers['Location']
                     method = GET
                     body = None
-                    # Read and ignore the body
-                    # response.read()
-                    # Sleep 100 ms before re-issuing the request
-                    sleep(0.1)
+                    # Back off before re-issuing the request, deferring to
+                    # the server when it says how long to wait
+                    poller.wait(retry_after=r.headers.get('Retry-After'))
                 else:
                     raise MyriaError('Error %d: %s'
                                      % (r.status_code, r.text))
@@ -141,8 +578,8 @@ class MyriaConnection(object):
         try:
             if '://' not in url:
                 url = self._url_start + url
-            r = self._session.request(method, url, headers=headers,
-                                      data=body, params=params, stream=True)
+            r = self._request(method, url, headers=headers,
+                              data=body, params=params, stream=True)
             logging.info("Make myria request to {}. Headers: {}".format(
                          r.url, headers))
             if r.status_code in [200, 201, 202]:
@@ -170,9 +607,7 @@ class MyriaConnection(object):
         if accepted is None:
             accepted = []
 
-        if '://' not in selector:
-            selector = self._url_start + selector
-        r = self._session.get(selector, params=params)
+        r = self._request(GET, selector, params=params)
         if r.status_code in status:
             return r.json()
         elif r.status_code in accepted:
@@ -191,9 +626,7 @@ class MyriaConnection(object):
             if accepted is None:
                 accepted = []
 
-        if '://' not in selector:
-            selector = self._url_start + selector
-        r = self._session.post(selector, data=data, params=params)
+        r = self._request(POST, selector, data=data, params=params)
         if r.status_code in status:
             if r.headers['Location']:
                 return self._wrap_get(r.headers['Location'], status=status,
@@ -212,9 +645,7 @@ class MyriaConnection(object):
             if accepted is None:
                 accepted = []
 
-        if '://' not in selector:
-            selector = self._url_start + selector
-        r = self._session.delete(selector, data=data)
+        r = self._request(DELETE, selector, data=data)
 
     def workers(self):
         """Return a dictionary of the workers"""
@@ -232,30 +663,137 @@ class MyriaConnection(object):
         """Return a list of the datasets that exist"""
         return self._wrap_get('/dataset')
 
-    def dataset(self, relation_key):
-        """Return information about the specified relation"""
-        return self._wrap_get('/dataset/user-{}/program-{}/relation-{}'.format(
-            relation_key['userName'],
-            relation_key['programName'],
-            relation_key['relationName']))
+    def dataset(self, relation_key, refresh=False):
+        """Return information about the specified relation, reusing
+        metadata fetched within the last metadata_ttl seconds unless
+        refresh is set"""
+        key = self._metadata_key(relation_key)
+        with self._metadata_lock:
+            expires, metadata = self._metadata.get(key, (0, None))
+            if expires > time.time() and not refresh:
+                self._cache['hits'] += 1
+                return copy.deepcopy(metadata)
+            self._cache['misses'] += 1
+
+        metadata = self._wrap_get(
+            '/dataset/user-{}/program-{}/relation-{}'.format(*key))
+        self.cache_metadata(relation_key, metadata)
+        return copy.deepcopy(metadata)
 
     def download_dataset(self, relation_key, limit=None):
         """Download the data in the dataset as json"""
+        return list(self.stream_dataset(relation_key, limit=limit))
+
+    def stream_dataset(self, relation_key, limit=None, batch_size=None):
+        """Download the data in the dataset as an iterator of tuples.
+
+        The response is decoded incrementally as it arrives, so peak memory
+        is bounded by the batch size rather than by the size of the relation.
+
+        Args:
+            relation_key: A dictionary containing the relation key.
+            limit: optional maximum number of tuples to download.
+            batch_size: optional number of tuples to group into each list
+                yielded by the iterator. When omitted, individual tuples are
+                yielded.
+        """
         parameters = {'format': 'json'}
         if limit is not None:
             parameters['limit'] = limit
-        return self._wrap_get('/dataset/user-{}/program-{}/relation-{}/data'
-                              .format(relation_key['userName'],
-                                      relation_key['programName'],
-                                      relation_key['relationName']),
-                              params=parameters)
+        url = '/dataset/user-{}/program-{}/relation-{}/data'.format(
+            relation_key['userName'],
+            relation_key['programName'],
+            relation_key['relationName'])
+        r = self._make_request(GET, url, params=parameters, get_request=True)
+        tuples = self._stream_tuples(r, url, parameters)
+        return _iter_batches(tuples, batch_size) if batch_size else tuples
+
+    def download_array(self, relation_key, schema, limit=None):
+        """Download an all-numeric dataset into a NumPy structured array.
+
+        The data is transferred as CSV, which is far more compact than JSON,
+        and parsed directly into a record array whose fields are typed by
+        the schema. The parsing uses the C parser of pandas when it is
+        installed.
+
+        Args:
+            relation_key: A dictionary containing the relation key.
+            schema: A dictionary containing the schema of the relation.
+            limit: optional maximum number of tuples to download.
+        """
+        if numpy is None:
+            raise ImportError('Must execute `pip install numpy` to download '
+                              'NumPy arrays')
+        names = schema['columnNames']
+        types = schema['columnTypes']
+        if any(type_ not in NUMERIC_TYPES for type_ in types):
+            raise MyriaError('Only numeric relations may be downloaded as '
+                             'arrays, not {}'.format(', '.join(types)))
+
+        parameters = {'format': 'csv'}
+        if limit is not None:
+            parameters['limit'] = limit
+        r = self._make_request(GET,
+                               '/dataset/user-{}/program-{}/relation-{}/data'
+                               .format(relation_key['userName'],
+                                       relation_key['programName'],
+                                       relation_key['relationName']),
+                               params=parameters, accept=CSV,
+                               get_request=True)
+        try:
+            return _parse_csv_array(
+                r.iter_content(chunk_size=CHUNK_SIZE), names,
+                numpy.dtype(zip(map(str, names),
+                                [DTYPES[t] for t in types])))
+        except ValueError as e:
+            raise MyriaError(e)
+        finally:
+            r.close()
+
+    def _stream_tuples(self, response, url, parameters):
+        """Yield the tuples of a streaming JSON response, retrying the
+        download if the connection fails before any tuple is delivered.
+
+        The order of the tuples of a relation stored on several workers may
+        differ between downloads, so a download that fails part way through
+        cannot be resumed; a MyriaError reports that it is incomplete."""
+        delivered = 0
+        attempt = self.retry.start()
+        try:
+            while True:
+                try:
+                    for value in _iter_json_array(
+                            response.iter_content(chunk_size=CHUNK_SIZE)):
+                        delivered += 1
+                        yield value
+                    return
+                except (requests.ConnectionError,
+                        requests.exceptions.ChunkedEncodingError) as e:
+                    if delivered:
+                        raise MyriaError(
+                            'Download of {} failed after {} tuples: {}'
+                            .format(url, delivered, e))
+                    if not attempt.retry():
+                        raise MyriaError(e)
+                    response.close()
+                    response = self._make_request(GET, url,
+                                                  params=parameters,
+                                                  get_request=True)
+        except Exception as e:
+            if isinstance(e, MyriaError):
+                raise
+            raise MyriaError(e)
+        finally:
+            response.close()
 
     def delete_dataset(self, relation_key):
         """Delete a relation"""
-        return self._wrap_delete('/dataset/user-{}/program-{}/relation-{}'
-                                 .format(relation_key['userName'],
-                                         relation_key['programName'],
-                                         relation_key['relationName']))
+        try:
+            return self._wrap_delete(
+                '/dataset/user-{}/program-{}/relation-{}'.format(
+                    *self._metadata_key(relation_key)))
+        finally:
+            self.invalidate_metadata(relation_key)
 
     @staticmethod
     def _ensure_schema(schema):
@@ -286,15 +824,34 @@ class MyriaConnection(object):
     def create_empty(self, relation_key, schema):
         return self.upload_source(relation_key, schema, {'dataType': 'Empty'})
 
-    def upload_fp(self, relation_key, schema, fp):
+    def upload_fp(self, relation_key, schema, fp, overwrite=None,
+                  delimiter=None, binary=None, is_little_endian=None,
+                  progress=None, use_base64=False):
         """Upload the data in the supplied fp to the specified user and
         relation.
 
+        The file is streamed to the server as multipart form data, so only
+        a chunk of it is held in memory at a time.
+
         Args:
             relation_key: A dictionary containing the destination relation key.
             schema: A dictionary containing the schema,
             fp: A file pointer containing the data to be uploaded.
+            overwrite, delimiter, binary, is_little_endian, progress: see
+                upload_file.
+            use_base64: optional boolean indicating that the data should
+                instead be base64-encoded and embedded in a JSON request, for
+                servers that do not accept multipart uploads. This reads the
+                whole file into memory, and ignores the other options.
         """
+        if not use_base64:
+            return self.upload_file(self._ensure_relation_key(relation_key),
+                                    self._ensure_schema(schema), fp,
+                                    overwrite=overwrite,
+                                    delimiter=delimiter,
+                                    binary=binary,
+                                    is_little_endian=is_little_endian,
+                                    progress=progress)
 
         data = base64.b64encode(fp.read())
         source = {'dataType': 'Bytes',
@@ -306,7 +863,10 @@ class MyriaConnection(object):
                 'schema': self._ensure_schema(schema),
                 'source': source}
 
-        return self._make_request(POST, '/dataset', json.dumps(body))
+        try:
+            return self._make_request(POST, '/dataset', json.dumps(body))
+        finally:
+            self.invalidate_metadata(relation_key)
 
     def execute_program(self, program, language="MyriaL", server=None,
                         wait_for_completion=True):
@@ -323,8 +883,11 @@ class MyriaConnection(object):
         raco = RacoMyriaConnection(
             rest_url=self._url_start,
             execution_url=self.execution_url)
-        return raco.execute_query(raco.compile_program(
-            program, language))
+        try:
+            return raco.execute_query(raco.compile_program(
+                program, language))
+        finally:
+            self.invalidate_metadata()
 
     def compile_program(self, program, language="MyriaL", profile=False):
         """Get a compiled plan for a given program.
@@ -348,6 +911,7 @@ class MyriaConnection(object):
         """
 
         body = json.dumps(query)
+        self.invalidate_metadata()
         return self._wrap_post('/query', data=body)
 
     def execute_query(self, query):
@@ -358,7 +922,10 @@ class MyriaConnection(object):
         """
 
         body = json.dumps(query)
-        return self._finish_async_request(POST, '/query', body)
+        try:
+            return self._finish_async_request(POST, '/query', body)
+        finally:
+            self.invalidate_metadata()
 
     def validate_query(self, query):
         """Submit the query to Myria for validation only.
@@ -481,13 +1048,18 @@ class MyriaConnection(object):
         return r.json()
 
     def upload_file(self, relation_key, schema, data, overwrite=None,
-                    delimiter=None, binary=None, is_little_endian=None):
+                    delimiter=None, binary=None, is_little_endian=None,
+                    progress=None, chunk_size=None, parallelism=4,
+                    manifest=None):
         """Upload a file in a streaming manner to Myria.
 
         Args:
             relation_key: relation to be created.
             schema: schema of the relation.
-            data: the bytes to be uploaded.
+            data: the bytes, a file pointer containing the bytes, or an
+                iterable (such as a generator) of chunks of bytes to be
+                uploaded. An iterable is sent as it is consumed, using
+                chunked transfer encoding.
             overwrite: optional boolean indicating that an existing relation
                 should be overwritten. Myria default is False.
             delimiter: optional character which delimits a CSV file. Only valid
@@ -496,9 +1068,30 @@ class MyriaConnection(object):
                 a packed binary. Myria default is False.
             is_little_endian: optional boolean indicating that the binary data
                 is in little-Endian. Myria default is False.
+            progress: optional function called as the upload proceeds with
+                the number of bytes sent so far and the total request size
+                (None when the data is an iterable of chunks).
+            chunk_size: optional number of bytes in each part of a chunked
+                upload. When specified, the data is split into parts (at line
+                or record boundaries) that are uploaded concurrently into
+                staging relations, then committed into the relation by a
+                single query. In this mode, a false overwrite appends to any
+                existing relation.
+            parallelism: the maximum number of parts uploaded concurrently
+                by a chunked upload.
+            manifest: optional path of a file recording the parts of a
+                chunked upload that have completed. Repeating an interrupted
+                upload with the same manifest only uploads the missing parts.
+                The manifest is rejected if the input (a string, or a file
+                identified by its size and modification time) has changed.
         """
+        if chunk_size:
+            return self._upload_chunked(relation_key, schema, data,
+                                        overwrite, delimiter, binary,
+                                        is_little_endian, chunk_size,
+                                        parallelism, manifest)
 
-        from requests_toolbelt import MultipartEncoder
+        from requests_toolbelt import MultipartEncoder, MultipartEncoderMonitor
 
         fields = [('relationKey', relation_key), ('schema', schema),
                   ('overwrite', overwrite), ('delimiter', delimiter),
@@ -512,10 +1105,291 @@ class MyriaConnection(object):
             data_type = 'text/plain'
         fields.append(('data', ('data', data, data_type)))
 
-        m = MultipartEncoder(fields=fields)
-        r = self._session.post(self._url_start + '/dataset', data=m,
-                               headers={'Content-Type': m.content_type})
+        if not isinstance(data, basestring) and not hasattr(data, 'read'):
+            m = _MultipartStream(fields, progress)
+        else:
+            m = MultipartEncoder(fields=fields)
+        if progress is not None and isinstance(m, MultipartEncoder):
+            m = MultipartEncoderMonitor(
+                m, lambda monitor: progress(monitor.bytes_read, monitor.len))
+        r = self._request(POST, '/dataset', data=m,
+                          headers={'Content-Type': m.content_type})
+        self.invalidate_metadata(relation_key)
         if r.status_code not in (200, 201):
             raise MyriaError('Error %d: %s'
                              % (r.status_code, r.text))
         return r.json()
+
+    def _upload_chunked(self, relation_key, schema, data, overwrite,
+                        delimiter, binary, is_little_endian, chunk_size,
+                        parallelism, manifest):
+        """Upload data in parts, then commit the parts into the relation"""
+        relation_key = self._ensure_relation_key(relation_key)
+        schema = self._ensure_schema(schema)
+        fp = StringIO(data) if isinstance(data, basestring) else data
+        if binary:
+            if any(type_ not in STRUCT_FORMATS
+                   for type_ in schema['columnTypes']):
+                raise MyriaError('Chunked binary uploads require fixed-width '
+                                 'types, not {}'.format(
+                                     ', '.join(schema['columnTypes'])))
+            width = struct.calcsize('<' + ''.join(
+                STRUCT_FORMATS[type_] for type_ in schema['columnTypes']))
+            chunk_size = max(chunk_size // width, 1) * width
+
+        state = self._load_manifest(manifest, relation_key, chunk_size,
+                                    self._input_fingerprint(data))
+        lock = Lock()
+        slots = BoundedSemaphore(parallelism)
+        failed = Event()
+        pool = ThreadPool(parallelism)
+
+        def upload_part(index, part, part_key):
+            try:
+                self.upload_file(part_key, schema, part, overwrite=True,
+                                 delimiter=delimiter, binary=binary,
+                                 is_little_endian=is_little_endian)
+                with lock:
+                    state['parts'].append(index)
+                    self._save_manifest(manifest, state)
+            except Exception:
+                failed.set()
+                raise
+            finally:
+                slots.release()
+
+        parts = []
+        results = []
+        committed = False
+        try:
+            try:
+                while True:
+                    part = fp.read(chunk_size)
+                    if part and not binary:
+                        part += fp.readline()
+                    if not part:
+                        break
+
+                    index = len(parts)
+                    parts.append(dict(
+                        relation_key, relationName='{}__part_{}_{}'.format(
+                            relation_key['relationName'], state['token'],
+                            index)))
+                    if index not in state['parts']:
+                        slots.acquire()
+                        # Stop reading the input once any part has failed
+                        if failed.is_set():
+                            break
+                        results.append(pool.apply_async(
+                            upload_part, (index, part, parts[-1])))
+                for result in results:
+                    result.get()
+            finally:
+                pool.close()
+                pool.join()
+
+            if not parts:
+                return self.upload_file(relation_key, schema, '',
+                                        overwrite=overwrite,
+                                        delimiter=delimiter, binary=binary,
+                                        is_little_endian=is_little_endian)
+
+            ret = self.commit_parts(relation_key, parts, overwrite)
+            committed = True
+        finally:
+            # Without a manifest, a failed upload cannot be resumed, so
+            # remove its staging relations, some of which may never have
+            # been created
+            if not committed and not manifest:
+                for part_key in parts:
+                    try:
+                        self.delete_dataset(part_key)
+                    except MyriaError:
+                        pass
+
+        if manifest and os.path.exists(manifest):
+            os.remove(manifest)
+        return ret
+
+    def commit_parts(self, relation_key, parts, overwrite=None):
+        """Store the union of several staging relations, such as the parts
+        of an upload, into a relation with a single query, then delete them.
+
+        Args:
+            relation_key: relation in which the parts are stored.
+            parts: the relation keys of the staging relations.
+            overwrite: optional boolean indicating that an existing relation
+                should be replaced. Otherwise, the parts are appended to it.
+        """
+        relation_key = self._ensure_relation_key(relation_key)
+        status = self.execute_query(get_union_plan(
+            parts, relation_key, overwrite=bool(overwrite),
+            text='Commit upload of {}'.format(relation_key['relationName'])))
+        if status['status'] != 'SUCCESS':
+            raise MyriaError('Failed to commit upload of {}: {}'.format(
+                relation_key['relationName'], status['status']))
+
+        for part_key in parts:
+            self.delete_dataset(part_key)
+        return self.dataset(relation_key)
+
+    @staticmethod
+    def _input_fingerprint(data):
+        """The digest of a string, or the size and modification time of a
+        file, identifying the input of a chunked upload"""
+        if isinstance(data, basestring):
+            return {'md5': hashlib.md5(data).hexdigest()}
+        try:
+            info = os.fstat(data.fileno())
+        except (AttributeError, IOError, OSError, ValueError):
+            return None
+        return {'size': info.st_size, 'mtime': info.st_mtime}
+
+    @staticmethod
+    def _load_manifest(path, relation_key, chunk_size, fingerprint=None):
+        """Load the state of an interrupted chunked upload, or start anew"""
+        if path and os.path.exists(path):
+            with open(path) as f:
+                state = json.load(f)
+            if state['relationKey'] != relation_key or \
+                    state['chunkSize'] != chunk_size:
+                raise MyriaError('Manifest {} describes a different upload'
+                                 .format(path))
+            if state.get('input') != fingerprint:
+                raise MyriaError('The input has changed since the upload '
+                                 'described by manifest {}'.format(path))
+            return state
+        return {'relationKey': relation_key,
+                'chunkSize': chunk_size,
+                'input': fingerprint,
+                'token': uuid4().hex[:8],
+                'parts': []}
+
+    @staticmethod
+    def _save_manifest(path, state):
+        """Atomically record the state of a chunked upload"""
+        if path:
+            with open(path + '.tmp', 'w') as f:
+                json.dump(state, f)
+            os.rename(path + '.tmp', path)
+
+
+class _BackgroundStream(object):
+    """An iterator over the batches that a background download puts on a
+    queue, which cancels the download when closed"""
+
+    def __init__(self, batches, cancelled, end):
+        self._batches = batches
+        self._cancelled = cancelled
+        self._end = end
+
+    def __iter__(self):
+        return self
+
+    def next(self):
+        if self._cancelled.is_set():
+            raise StopIteration
+        batch = self._batches.get()
+        if batch is self._end:
+            self.close()
+            raise StopIteration
+        elif isinstance(batch, Exception):
+            self.close()
+            raise batch
+        return batch
+
+    def close(self):
+        """Stop the download, even if it has not been exhausted"""
+        self._cancelled.set()
+
+    __del__ = close
+
+
+class MyriaAsyncConnection(object):
+    """A non-blocking counterpart to MyriaConnection.
+
+    Every public method of MyriaConnection is available with the same
+    arguments, but runs on a pool of worker threads and immediately returns
+    a multiprocessing.pool.AsyncResult; call its get() method to wait for
+    the result (or to re-raise the error) of the request. This lets a single
+    thread drive many concurrent queries and transfers.
+    """
+
+    _END = object()
+
+    def __init__(self, connection=None, pool=None, **kwargs):
+        """Wrap a connection to the Myria REST server.
+
+        Args:
+            connection: the MyriaConnection used to issue requests. When
+                omitted, one is created by passing any remaining keyword
+                arguments to MyriaConnection.
+            pool: the thread pool on which requests run. Defaults to a pool
+                of DEFAULT_CONCURRENCY threads shared by all asynchronous
+                connections.
+        """
+        self.connection = connection or MyriaConnection(**kwargs)
+        self._pool = pool or _get_default_pool()
+
+    def __getattr__(self, name):
+        attribute = getattr(self.connection, name)
+        if name.startswith('_') or not callable(attribute):
+            return attribute
+        return lambda *args, **kwargs: self.submit(attribute,
+                                                   *args, **kwargs)
+
+    def submit(self, function, *args, **kwargs):
+        """Run function(*args, **kwargs) on the pool, returning an
+        AsyncResult"""
+        return self._pool.apply_async(function, args, kwargs)
+
+    def stream_dataset(self, relation_key, limit=None, batch_size=1000,
+                       prefetch=4):
+        """Download the data in the dataset in the background.
+
+        Returns an iterator over batches of tuples. Batches are downloaded
+        and decoded on the pool while the caller consumes earlier ones, with
+        at most prefetch batches buffered at a time.
+
+        Args:
+            relation_key: A dictionary containing the relation key.
+            limit: optional maximum number of tuples to download.
+            batch_size: the number of tuples in each batch.
+            prefetch: the maximum number of undelivered batches.
+
+        The download stops, releasing its pool thread, once the iterator is
+        closed or garbage collected, even if it was not exhausted or was
+        never started.
+        """
+        batches = Queue(prefetch)
+        cancelled = Event()
+
+        def put(item):
+            # Wait for space, but give up once the consumer has gone away
+            while not cancelled.is_set():
+                try:
+                    batches.put(item, timeout=0.1)
+                    return True
+                except Full:
+                    pass
+            return False
+
+        def produce():
+            try:
+                stream = self.connection.stream_dataset(
+                    relation_key, limit=limit, batch_size=batch_size)
+            except Exception as e:
+                put(e)
+                return
+            try:
+                for batch in stream:
+                    if not put(batch):
+                        return
+                put(self._END)
+            except Exception as e:
+                put(e)
+            finally:
+                stream.close()
+
+        self.submit(produce)
+        return _BackgroundStream(batches, cancelled, self._END)
@@ -1,7 +1,14 @@
 # coding=utf-8
 
+from collections import OrderedDict
+import copy
+from datetime import datetime
 import hashlib
+import re
+from threading import Lock
 
+from dateutil.parser import parse
+from dateutil.tz import tzutc
 from raco import compile
 from raco.algebra import Store, Select, Apply, Scan, CrossProduct, Sequence, \
     ProjectingJoin, UnionAll, Sink, GroupBy, \
@@ -18,8 +25,15 @@ from raco.relation_key import RelationKey
 from raco.scheme import Scheme
 from raco.types import STRING_TYPE, BOOLEAN_TYPE
 
+from myria.errors import MyriaError
 from myria.udf import MyriaPythonFunction, MyriaFunction
 
+# The number of compiled plans retained, least recently used first
+PLAN_CACHE_SIZE = 64
+
+_plan_cache = OrderedDict()
+_plan_cache_lock = Lock()
+
 
 def _get_column_index(inputs, aliases, attribute):
     """
@@ -55,29 +69,104 @@ def _get_column_index(inputs, aliases, attribute):
         return UnnamedAttributeRef(ref.get_position(schema))
 
 
-def _unique_name(query):
-    """ Generate a unique relation name """
-    return 'result_%s' % hashlib.md5(str(query)).hexdigest()
+def _unique_name(query, fingerprints=()):
+    """ Generate a unique relation name, which also depends on the
+        fingerprints of the UDFs that the query calls """
+    return 'result_%s' % hashlib.md5(
+        str(query) + ''.join(fingerprints)).hexdigest()
+
+
+def _udf_names(query):
+    """ The names of the Python UDFs called by a query """
+    names = set()
+    for op in query.walk():
+        expressions = [expression for _, expression in
+                       getattr(op, 'emitters', None) or []]
+        expressions += getattr(op, 'grouping_list', None) or []
+        expressions += getattr(op, 'aggregate_list', None) or []
+        if getattr(op, 'condition', None) is not None:
+            expressions.append(op.condition)
+        for expression in expressions:
+            names.update(getattr(node.name, 'value', node.name)
+                         for node in expression.walk()
+                         if isinstance(node, PYUDF))
+    return sorted(names)
+
+
+# Matches the names generated by _unique_name
+_UNIQUE_NAME = re.compile(r'^result_[0-9a-f]{32}$')
+
+
+def _relation_key(key):
+    """ Convert a raco RelationKey into a Myria relation key """
+    return {'userName': key.user,
+            'programName': key.program,
+            'relationName': key.relation}
+
+
+def _age(created):
+    """ The number of seconds since the given creation time """
+    created = parse(created)
+    now = datetime.now(tzutc()) if created.tzinfo else datetime.now()
+    return (now - created).total_seconds()
 
 
 def _create_udf(source_or_ast_or_callable, schema, connection,
                 name=None, out_type=None, multivalued=False):
-    name = name or _unique_name(str(source_or_ast_or_callable))
     out_type = out_type or STRING_TYPE
 
-    MyriaPythonFunction(source_or_ast_or_callable,
-                        str(out_type),
-                        name,
-                        multivalued,
-                        connection=connection).register()
+    function = MyriaPythonFunction(source_or_ast_or_callable,
+                                   str(out_type),
+                                   name or 'udf',
+                                   multivalued,
+                                   connection=connection)
+    # Name anonymous functions by their content, so that converting the
+    # same expression again reuses the function already registered
+    function.name = name or 'udf_%s' % function.fingerprint
+    function.register()
     return PYUDF(
-        StringLiteral(name),
+        StringLiteral(function.name),
         out_type,
         *[StringLiteral(name) for scheme in schema
           for name in scheme.get_names()])
 
 
+class _FluentContext(object):
+    """ State shared by every fluent query derived from a common root """
+
+    def __init__(self, connection):
+        """
+        Create a new context; the catalog and UDFs are loaded on first use
+        :param connection: The connection used by queries in this context
+        """
+        self.connection = connection
+        self._catalog = None
+        self._udfs = None
+
+    @property
+    def catalog(self):
+        """ The catalog used to look up relation schemas """
+        if self._catalog is None:
+            self._catalog = MyriaCatalog(self.connection)
+        return self._catalog
+
+    @property
+    def udfs(self):
+        """ The UDFs available when converting Python expressions """
+        if self._udfs is None:
+            self._udfs = [f.to_dict()
+                          for f in MyriaFunction.get_all(self.connection)]
+        return self._udfs
+
+
 class MyriaFluentQuery(object):
+    # Whether execute reuses the stored result of an identical query
+    ReuseResults = False
+    # Limits on the stored results kept when reusing them; see evict_results
+    ResultMaxAge = None
+    ResultMaxCount = None
+    ResultMaxTuples = None
+
     def __init__(self, parent, query, connection=None):
         """
         Create a new fluent query
@@ -88,10 +177,29 @@ class MyriaFluentQuery(object):
         self.parent = parent
         self.query = query
         self.connection = connection if connection else parent.connection
-        self.catalog = MyriaCatalog(self.connection)
         self.result = None
-        self.udfs = [f.to_dict()
-                     for f in MyriaFunction.get_all(self.connection)]
+        self._context = None
+
+    @property
+    def context(self):
+        """ The context shared with the parent of this query, when both use
+            the same connection """
+        if self._context is None:
+            self._context = self.parent.context \
+                if self.parent is not None and \
+                self.parent.connection is self.connection \
+                else _FluentContext(self.connection)
+        return self._context
+
+    @property
+    def catalog(self):
+        """ The catalog shared by this query and those derived from it """
+        return self.context.catalog
+
+    @property
+    def udfs(self):
+        """ The UDFs shared by this query and those derived from it """
+        return self.context.udfs
 
     def _scan(self, components):
         """ Scan a relation with the given name components """
@@ -290,31 +398,144 @@ class MyriaFluentQuery(object):
     def to_dataframe(self, index=None):
         return self.execute().to_dataframe(index)
 
-    def execute(self, relation=None):
+    def execute(self, relation=None, reuse=None):
         """
         Execute a query
         :param relation: The name of a relation in which the result is stored
+        :param reuse: When no relation is given, return the result stored by
+                      an identical query if it is newer than every relation
+                      it was computed from (default: ReuseResults)
         :return: A MyriaQuery instance that represents the executing query
         """
         from myria.query import MyriaQuery
 
+        reuse = self.ReuseResults if reuse is None else reuse
+        stored = None
+        if not self.result and reuse and not relation:
+            stored = self._result_name()
+            self.result = self._stored_result(stored)
         if not self.result:
-            json = self._store(relation or _unique_name(self.query)).to_json()
+            name = relation or stored or _unique_name(self.query)
+            if reuse and (self.ResultMaxAge is not None or
+                          self.ResultMaxCount is not None or
+                          self.ResultMaxTuples is not None):
+                # Evict before submitting, and never the relation that this
+                # query is about to overwrite
+                key = RelationKey(name if isinstance(name, basestring)
+                                  else name.name)
+                self.evict_results(self.connection,
+                                   max_age=self.ResultMaxAge,
+                                   max_count=self.ResultMaxCount,
+                                   max_tuples=self.ResultMaxTuples,
+                                   user=key.user, program=key.program,
+                                   exclude=[key.relation])
+            json = self._store(name).to_json()
             self.result = MyriaQuery.submit_plan(json, self.connection)
         return self.result
 
+    def _result_name(self):
+        """ The name of the relation storing the result of this query,
+            which changes when any UDF that it calls is registered anew
+            with different code """
+        fingerprints = []
+        for udf in _udf_names(self.query):
+            try:
+                fingerprints.append(MyriaFunction._load(
+                    self.connection.get_function(udf),
+                    self.connection).fingerprint)
+            except MyriaError:
+                fingerprints.append('')
+        return _unique_name(self.query, fingerprints)
+
+    def _stored_result(self, name):
+        """ The query that stored an up-to-date result of this query in the
+            named relation, if any """
+        from myria.query import MyriaQuery
+
+        operators = list(self.query.walk())
+        # The freshness of files read by a query cannot be checked
+        if any(isinstance(op, FileScan) for op in operators):
+            return None
+        # Cached metadata could hide an input overwritten since
+        try:
+            result = self.connection.dataset(
+                _relation_key(RelationKey(name)), refresh=True)
+            inputs = [self.connection.dataset(_relation_key(op.relation_key),
+                                              refresh=True)
+                      for op in operators if isinstance(op, Scan)]
+        except MyriaError:
+            return None
+
+        if result.get('queryId') is None or \
+                any(_age(metadata['created']) <= _age(result['created'])
+                    for metadata in inputs):
+            return None
+        return MyriaQuery(result['queryId'], self.connection)
+
+    @staticmethod
+    def evict_results(connection, max_age=None, max_count=None,
+                      max_tuples=None, user='public', program='adhoc',
+                      exclude=()):
+        """
+        Delete the relations in which executed queries stored their results,
+        i.e., those of the given user and program named result_<md5>
+        :param connection: The connection to the Myria instance
+        :param max_age: Delete results older than this many seconds
+        :param max_count: Delete all but this many of the newest results
+        :param max_tuples: Delete the oldest results until the rest hold at
+                           most this many tuples in total
+        :param user: The user whose results are deleted
+        :param program: The program whose results are deleted
+        :param exclude: Names of results that are never deleted
+        :return: The relation keys of the deleted results
+        """
+        results = sorted(
+            (metadata for metadata in connection.datasets()
+             if metadata['relationKey']['userName'] == user and
+             metadata['relationKey']['programName'] == program and
+             _UNIQUE_NAME.match(metadata['relationKey']['relationName']) and
+             metadata['relationKey']['relationName'] not in exclude),
+            key=lambda metadata: _age(metadata['created']))
+
+        evicted, tuples = [], 0
+        for index, metadata in enumerate(results):
+            tuples += max(int(metadata.get('numTuples', 0)), 0)
+            if (max_age is not None and
+                    _age(metadata['created']) > max_age) or \
+                    (max_count is not None and index >= max_count) or \
+                    (max_tuples is not None and tuples > max_tuples):
+                connection.delete_dataset(metadata['relationKey'])
+                evicted.append(metadata['relationKey'])
+        return evicted
+
     def sink(self):
         """ Execute the query but ignore its results """
         from myria.query import MyriaQuery
         return MyriaQuery.submit_plan(self._sink().to_json(), self.connection)
 
     def to_json(self):
-        """ Convert this query into an optimized JSON plan """
-        # TODO deep copy, since optimize mutates
-        sequence = Sequence([self.query])
-        optimized = compile.optimize(sequence, OptLogicalAlgebra())
-        myria = compile.optimize(optimized, MyriaLeftDeepTreeAlgebra())
-        return compile_to_json(str(self.query), optimized, myria)
+        """ Convert this query into an optimized JSON plan, reusing the
+            plan compiled for any structurally identical query while the
+            catalog is unchanged """
+        key = (hashlib.md5(repr(self.query)).hexdigest(),
+               self.connection, self.connection.catalog_version)
+        with _plan_cache_lock:
+            plan = _plan_cache.pop(key, None)
+            if plan is not None:
+                _plan_cache[key] = plan
+
+        if plan is None:
+            # Optimization mutates the tree, which is shared with the
+            # queries from which this one was derived
+            sequence = Sequence([copy.deepcopy(self.query)])
+            optimized = compile.optimize(sequence, OptLogicalAlgebra())
+            myria = compile.optimize(optimized, MyriaLeftDeepTreeAlgebra())
+            plan = compile_to_json(str(self.query), optimized, myria)
+            with _plan_cache_lock:
+                _plan_cache[key] = plan
+                while len(_plan_cache) > PLAN_CACHE_SIZE:
+                    _plan_cache.popitem(last=False)
+        return copy.deepcopy(plan)
 
     def _convert(self, source_or_ast_or_callable,
                  scheme=None, out_type=None, multivalued=False):
@@ -326,5 +547,6 @@ class MyriaFluentQuery(object):
                               connection=self.connection,
                               out_type=out_type,
                               multivalued=multivalued)
-            self.udfs.append([udf.name, len(udf.arguments), udf.typ])
+            self.udfs.append({'name': udf.name.value,
+                              'outputType': udf.typ})
             return udf
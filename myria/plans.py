@@ -1,14 +1,22 @@
 """ Utilities for generating Myria plans """
 
+import os
 from functools import partial
+from urlparse import urlparse
+
+import requests
 
 DEFAULT_SCAN_TYPE = {'readerType': 'CSV'}
 DEFAULT_INSERT_TYPE = 'DbInsert'
 
+# Bytes read at a time while searching for the end of a record
+BOUNDARY_WINDOW = 64 * 1024
+
 
 def get_parallel_import_plan(schema, work, relation, text='',
                              scan_parameters=None, insert_parameters=None,
-                             scan_type=None, insert_type=None):
+                             scan_type=None, insert_type=None,
+                             balance=False, sizes=None, partitioning=None):
     """ Generate a valid JSON Myria plan for parallel import of data
 
     work: list of (worker-id, data-source) pairs; data-source should be a
@@ -21,16 +29,82 @@ def get_parallel_import_plan(schema, work, relation, text='',
       insert_parameters: dict of additional operator parameters for insertion
       scan_type: type of scan to perform
       insert_Type: type of insert to perform
+      balance: rather than importing each data source on the worker it is
+               paired with, pack the data sources onto the same set of
+               workers by size (see pack_work). The predicted number of
+               bytes read by each worker is appended to the description.
+      sizes: list of the size, in bytes, of each data source when balancing
+             (by default, looked up for URI data sources)
+      partitioning: optional distribute function (see
+                    get_distribute_function) by which the imported tuples
+                    are shuffled across workers before they are stored
     """
+    taskid = [0]
+    if balance:
+        assignments, loads = pack_work(work, sizes)
+        reader = dict(scan_type or DEFAULT_SCAN_TYPE, schema=schema.to_dict())
+        text = (text + '\n' if text else '') + \
+            'Predicted bytes read by each worker: ' + \
+            ', '.join('{}={}'.format(worker_id, load)
+                      for worker_id, load in sorted(loads.items()))
+        fragments = [_get_import_fragment(
+            taskid, relation, insert_type, scan_parameters,
+            insert_parameters, worker_id,
+            [(reader, source) for source in sources])
+            for worker_id, sources in assignments]
+    else:
+        fragments = map(partial(_get_parallel_import_fragment, taskid,
+                                schema, relation,
+                                scan_type, insert_type,
+                                scan_parameters, insert_parameters), work)
+    if partitioning:
+        fragments = _shuffle_fragments(taskid, fragments, partitioning)
+
     return \
-        {"fragments": map(partial(_get_parallel_import_fragment, [0],
-                                  schema, relation,
-                                  scan_type, insert_type,
-                                  scan_parameters, insert_parameters), work),
+        {"fragments": fragments,
          "logicalRa": text,
          "rawQuery": text}
 
 
+def pack_work(work, sizes=None):
+    """ Reassign data sources to workers, balancing the bytes each reads
+    with the longest-processing-time-first heuristic: in decreasing order
+    of size, each data source goes to the least loaded worker.
+
+    work: list of (worker-id, data-source) pairs; the data sources are
+          packed onto the set of workers that appear in it
+    sizes: list of the size, in bytes, of each data source. By default,
+           the sizes of URI data sources are looked up with get_input_size.
+           Data sources of unknown size count as the average known size.
+
+    Returns (assignments, loads), where assignments is a list of
+    (worker-id, data-sources) pairs and loads maps each worker id to its
+    predicted number of bytes.
+    """
+    workers = []
+    for worker_id, _ in work:
+        if worker_id not in workers:
+            workers.append(worker_id)
+    sources = [source for _, source in work]
+    if sizes is None:
+        sizes = [get_input_size(source['uri']) if 'uri' in source else None
+                 for source in sources]
+
+    known = [size for size in sizes if size is not None]
+    default = sum(known) // len(known) if known else 1
+    sizes = [default if size is None else size for size in sizes]
+
+    assignments = dict((worker_id, []) for worker_id in workers)
+    loads = dict((worker_id, 0) for worker_id in workers)
+    for index in sorted(range(len(sources)), key=lambda i: -sizes[i]):
+        worker_id = min(workers, key=lambda w: loads[w])
+        assignments[worker_id].append(sources[index])
+        loads[worker_id] += sizes[index]
+
+    return ([(worker, assignments[worker]) for worker in workers
+             if assignments[worker]], loads)
+
+
 def _get_parallel_import_fragment(taskid, schema, relation,
                                   scan_type, insert_type,
                                   scan_parameters, insert_parameters,
@@ -65,6 +139,359 @@ def _get_parallel_import_fragment(taskid, schema, relation,
             'operators': [scan, insert]}
 
 
+def get_input_size(uri):
+    """ The size in bytes of a local (file://) or http(s):// input, or None
+    if it cannot be determined """
+    parsed = urlparse(uri)
+    if parsed.scheme in ('', 'file'):
+        try:
+            return os.path.getsize(_local_path(parsed))
+        except OSError:
+            return None
+    elif parsed.scheme in ('http', 'https'):
+        r = requests.head(uri, allow_redirects=True)
+        length = r.headers.get('Content-Length')
+        return int(length) if r.ok and length is not None else None
+    return None
+
+
+def _local_path(parsed):
+    """ The path of a (parsed) file:// URI; file://foo/bar names foo/bar """
+    return parsed.netloc + parsed.path
+
+
+def _read_range(uri, start, end):
+    """ Read the bytes [start, end) of a local or http(s):// input """
+    parsed = urlparse(uri)
+    if parsed.scheme in ('', 'file'):
+        with open(_local_path(parsed), 'rb') as f:
+            f.seek(start)
+            return f.read(end - start)
+
+    r = requests.get(uri, headers={'Range': 'bytes={}-{}'.format(start,
+                                                                 end - 1)})
+    r.raise_for_status()
+    # A server that ignores the range returns the whole input
+    return r.content if r.status_code == 206 else r.content[start:end]
+
+
+def find_record_boundary(uri, offset, size, delimiter='\n'):
+    """ The offset of the first record of an input that starts at or after
+    offset, i.e., just past the next record delimiter. Returns the size of
+    the input when no record starts after offset. """
+    if offset <= 0 or offset >= size:
+        return min(max(offset, 0), size)
+
+    position = max(offset - len(delimiter), 0)
+    while position < size:
+        data = _read_range(uri, position,
+                           min(position + BOUNDARY_WINDOW, size))
+        index = data.find(delimiter)
+        if index >= 0:
+            return position + index + len(delimiter)
+        elif not data:
+            break
+        # Keep enough bytes to find a delimiter split across windows
+        position += max(len(data) - len(delimiter) + 1, 1)
+    return size
+
+
+def split_inputs(uris, workers, sizes=None, delimiter='\n'):
+    """ Split inputs into byte ranges, aligned to record boundaries, that
+    balance the total number of bytes read by each worker
+
+    uris: list of the inputs to be split
+    workers: list of the ids of the workers among which to split them
+
+    Keyword arguments:
+      sizes: list of the size of each input, in bytes; by default, these are
+             looked up with get_input_size. Inputs of unknown (None) size are
+             not split, and go to the least loaded workers.
+      delimiter: the string that ends each record. Records must not contain
+                 it, e.g., within quoted CSV fields.
+
+    Returns a list of (worker-id, ranges) pairs, where ranges is a list of
+    (uri, start, end) tuples. The end of an input of unknown size is None.
+    """
+    workers = list(workers)
+    if sizes is None:
+        sizes = [get_input_size(uri) for uri in uris]
+
+    # Worker i reads the records starting in bytes [i * share, (i+1) * share)
+    # of the inputs' concatenation
+    total = sum(size for size in sizes if size is not None)
+    share = max(-(-total // len(workers)), 1)
+    assignments = [[] for _ in workers]
+    loads = [0] * len(workers)
+
+    offset = 0
+    for uri, size in zip(uris, sizes):
+        if size is None:
+            continue
+
+        start = 0
+        worker = min(offset // share, len(workers) - 1)
+        while start < size:
+            cut = (worker + 1) * share - offset
+            if worker == len(workers) - 1 or cut >= size:
+                end = size
+            else:
+                end = find_record_boundary(uri, max(cut, start), size,
+                                           delimiter)
+            if end > start:
+                assignments[worker].append((uri, start, end))
+                loads[worker] += end - start
+            start = end
+            if end < size:
+                worker += 1
+        offset += size
+
+    for uri, size in zip(uris, sizes):
+        if size is None:
+            worker = loads.index(min(loads))
+            assignments[worker].append((uri, 0, None))
+            loads[worker] += total // len(workers) or 1
+
+    return [(worker_id, ranges)
+            for worker_id, ranges in zip(workers, assignments) if ranges]
+
+
+def _range_source(uri, start, end):
+    """ The JSON encoding of a data source reading bytes [start, end) of an
+    input, or all of it when end is None """
+    source = {'dataType': 'URI', 'uri': uri}
+    if end is not None:
+        source.update({'startRange': start, 'endRange': end})
+    return source
+
+
+def get_range_import_plan(schema, assignments, relation, text='',
+                          scan_parameters=None, insert_parameters=None,
+                          scan_type=None, insert_type=None,
+                          partitioning=None):
+    """ Generate a valid JSON Myria plan for parallel import of byte ranges
+    of several inputs
+
+    assignments: list of (worker-id, ranges) pairs, where ranges is a list
+                 of (uri, start, end) tuples such as returned by
+                 split_inputs
+    relation: dict containing a qualified Myria relation name
+
+    Keyword arguments are as for get_parallel_import_plan. Header lines are
+    only skipped (as per the 'skip' of the scan_type) at the start of each
+    input.
+    """
+    scan_type = dict(scan_type or DEFAULT_SCAN_TYPE,
+                     schema=schema.to_dict())
+    taskid = [0]
+
+    def source(uri, start, end):
+        reader = dict(scan_type)
+        if start:
+            reader.pop('skip', None)
+        return reader, _range_source(uri, start, end)
+
+    fragments = [_get_import_fragment(
+        taskid, relation, insert_type, scan_parameters,
+        insert_parameters, worker_id,
+        [source(*range_) for range_ in ranges])
+        for worker_id, ranges in assignments]
+    if partitioning:
+        fragments = _shuffle_fragments(taskid, fragments, partitioning)
+
+    return \
+        {"fragments": fragments,
+         "logicalRa": text,
+         "rawQuery": text}
+
+
+def _get_import_fragment(taskid, relation, insert_type, scan_parameters,
+                         insert_parameters, worker_id, sources):
+    """ Generate a fragment that imports several (reader, data-source) pairs
+    on a single worker """
+    scans = []
+    for reader, datasource in sources:
+        scan = {
+            'opId': __increment(taskid),
+            'opType': 'TupleSource',
+
+            'reader': reader,
+            'source': datasource
+        }
+        scan.update(scan_parameters or {})
+        scans.append(scan)
+
+    operators = list(scans)
+    if len(scans) > 1:
+        operators.append({
+            'opId': __increment(taskid),
+            'opType': 'UnionAll',
+
+            'argChildren': [op['opId'] for op in scans]
+        })
+
+    insert = {
+        'opId': __increment(taskid),
+        'opType': insert_type or DEFAULT_INSERT_TYPE,
+
+        'argChild': operators[-1]['opId'],
+        'argOverwriteTable': True,
+
+        'relationKey': relation
+    }
+    insert.update(insert_parameters or {})
+
+    return {'overrideWorkers': [worker_id],
+            'operators': operators + [insert]}
+
+
+def get_distribute_function(schema, columns, function='Hash'):
+    """ The JSON encoding of a function that distributes tuples across
+    workers by the values of some of their columns
+
+    schema: the MyriaSchema of the tuples
+    columns: list of the names or indexes of the columns
+
+    Keyword arguments:
+      function: 'Hash' to hash the columns, or 'Identity' to send each tuple
+                to the worker identified by the value of its single column
+    """
+    indexes = [schema.names.index(column)
+               if isinstance(column, basestring) else column
+               for column in columns]
+    if function == 'Hash':
+        return {'type': 'Hash', 'indexes': indexes}
+    elif function == 'Identity':
+        if len(indexes) != 1:
+            raise ValueError('Identity partitioning requires a single column')
+        return {'type': 'Identity', 'index': indexes[0]}
+    raise ValueError('Unsupported partitioning function: {}'.format(function))
+
+
+def _shuffle_fragments(taskid, fragments, distribute_function):
+    """ Replace the insert ending each import fragment by a shuffle, and add
+    a fragment that stores the shuffled tuples on every worker. Since the
+    insert records the distribute function, the relation's partitioning is
+    known to later queries. """
+    if not fragments:
+        raise ValueError('A partitioned import requires at least one data '
+                         'source')
+    producers = []
+    for fragment in fragments:
+        insert = fragment['operators'].pop()
+        producers.append({
+            'opId': __increment(taskid),
+            'opType': 'ShuffleProducer',
+
+            'argChild': insert['argChild'],
+            'distributeFunction': distribute_function
+        })
+        fragment['operators'].append(producers[-1])
+
+    operators = [{'opId': __increment(taskid),
+                  'opType': 'ShuffleConsumer',
+
+                  'argOperatorId': producer['opId']}
+                 for producer in producers]
+    if len(operators) > 1:
+        operators.append({
+            'opId': __increment(taskid),
+            'opType': 'UnionAll',
+
+            'argChildren': [consumer['opId'] for consumer in operators]
+        })
+
+    insert = dict(insert,
+                  opId=__increment(taskid),
+                  argChild=operators[-1]['opId'],
+                  distributeFunction=distribute_function)
+    return fragments + [{'operators': operators + [insert]}]
+
+
+def get_partition_plan(relation, partitions, text=''):
+    """ Generate a valid JSON Myria plan that copies the partition of a
+    relation stored on each worker into a separate relation
+
+    relation: dict containing the qualified name of the source relation
+    partitions: list of (worker-id, relation) pairs, where each relation is a
+                dict containing the qualified name of the relation that
+                receives the tuples stored on that worker
+
+    Keyword arguments:
+      text: description of the plan
+    """
+    return \
+        {"fragments": map(partial(_get_partition_fragment, [0], relation),
+                          partitions),
+         "logicalRa": text,
+         "rawQuery": text}
+
+
+def _get_partition_fragment(taskid, relation, assignment):
+    """ Generate a single fragment of the partition plan """
+    worker_id = assignment[0]
+    partition = assignment[1]
+
+    scan = {
+        'opId': __increment(taskid),
+        'opType': 'TableScan',
+
+        'relationKey': relation
+    }
+
+    insert = {
+        'opId': __increment(taskid),
+        'opType': DEFAULT_INSERT_TYPE,
+
+        'argChild': taskid[0] - 2,
+        'argOverwriteTable': True,
+
+        'relationKey': partition
+    }
+
+    return {'overrideWorkers': [worker_id],
+            'operators': [scan, insert]}
+
+
+def get_union_plan(sources, relation, overwrite=True, text=''):
+    """ Generate a valid JSON Myria plan that stores the union of several
+    relations into a single relation
+
+    sources: list of dicts containing the qualified names of the relations
+             to combine
+    relation: dict containing the qualified name of the destination
+
+    Keyword arguments:
+      overwrite: replace the destination; when False, the union is appended
+                 to the existing relation
+      text: description of the plan
+    """
+    taskid = [0]
+    scans = [{'opId': __increment(taskid),
+              'opType': 'TableScan',
+
+              'relationKey': source} for source in sources]
+    union = {
+        'opId': __increment(taskid),
+        'opType': 'UnionAll',
+
+        'argChildren': [scan['opId'] for scan in scans]
+    }
+    insert = {
+        'opId': __increment(taskid),
+        'opType': DEFAULT_INSERT_TYPE,
+
+        'argChild': union['opId'],
+        'argOverwriteTable': overwrite,
+
+        'relationKey': relation
+    }
+
+    return {"fragments": [{'operators': scans + [union, insert]}],
+            "logicalRa": text,
+            "rawQuery": text}
+
+
 def __increment(value):
     value[0] += 1
     return value[0] - 1
@@ -0,0 +1,168 @@
+""" Strategies for polling long-running Myria requests and retrying
+    failed ones """
+
+import random
+import time
+from email.utils import parsedate_tz, mktime_tz
+from threading import Lock
+
+__all__ = ['PollingStrategy', 'RetryPolicy']
+
+
+class PollingStrategy(object):
+    """ Exponential backoff, with jitter, between successive polls """
+
+    def __init__(self, initial=0.05, multiplier=2.0, maximum=5.0,
+                 jitter=0.1):
+        """ Create a new polling strategy
+
+        initial: seconds to wait before the first re-poll
+        multiplier: factor by which the delay grows after each poll
+        maximum: upper bound on the delay between polls, in seconds
+        jitter: fraction by which each delay is randomly perturbed, to
+                avoid synchronized polling by many clients
+        """
+        self.initial = initial
+        self.multiplier = multiplier
+        self.maximum = maximum
+        self.jitter = jitter
+
+        self._lock = Lock()
+        self.polls = 0
+        self.wait_time = 0.0
+        self.wasted_time = 0.0
+
+    def delays(self):
+        """ Generate the successive delays between polls """
+        delay = self.initial
+        while True:
+            yield delay * (1 + random.uniform(-self.jitter, self.jitter))
+            delay = min(delay * self.multiplier, self.maximum)
+
+    def start(self):
+        """ Begin polling a single request """
+        return _Poller(self)
+
+    @property
+    def stats(self):
+        """ Poll count and time spent waiting across all polled requests.
+            The wasted time is an upper bound on the latency added after
+            requests completed but before a poll observed it. """
+        return {'polls': self.polls,
+                'wait_time': self.wait_time,
+                'wasted_time': self.wasted_time}
+
+    def _record(self, delay, wasted=0.0):
+        with self._lock:
+            if delay:
+                self.polls += 1
+                self.wait_time += delay
+            self.wasted_time += wasted
+
+
+class _Poller(object):
+    """ The polling state of a single request """
+
+    def __init__(self, strategy):
+        self.strategy = strategy
+        self._delays = strategy.delays()
+        self._last = 0.0
+
+    def wait(self, retry_after=None, deadline=None):
+        """ Sleep until the request should next be polled
+
+        retry_after: the value of a Retry-After header, which overrides the
+                     backoff delay when present
+        deadline: a time (as per time.time) that the wait will not exceed
+        """
+        delay = next(self._delays)
+        if retry_after is not None:
+            delay = _parse_retry_after(retry_after, delay)
+        if deadline is not None:
+            delay = max(min(delay, deadline - time.time()), 0)
+
+        time.sleep(delay)
+        self._last = delay
+        self.strategy._record(delay)
+
+    def finish(self):
+        """ Note that the request has completed """
+        self.strategy._record(0, wasted=self._last)
+
+
+class RetryPolicy(object):
+    """ Decides which failed requests are retried, and how long to wait
+        before doing so """
+
+    def __init__(self, retries=3, backoff=None,
+                 statuses=(500, 502, 503, 504),
+                 methods=('GET', 'HEAD', 'OPTIONS')):
+        """ Create a new retry policy
+
+        retries: the maximum number of times a request is retried
+        backoff: the PollingStrategy that spaces out retries
+        statuses: the HTTP status codes indicating a transient failure
+        methods: the idempotent HTTP methods that may safely be retried;
+                 requests using any other method (e.g., a POST that submits
+                 a query) are never retried
+        """
+        self.retries = retries
+        self.backoff = backoff or PollingStrategy(initial=0.1)
+        self.statuses = statuses
+        self.methods = methods
+
+        self._lock = Lock()
+        self.retried = 0
+        self.exhausted = 0
+
+    def is_idempotent(self, method):
+        """ May requests using the given HTTP method be retried? """
+        return method.upper() in self.methods
+
+    def start(self):
+        """ Begin issuing a single request """
+        return _Retrier(self)
+
+    @property
+    def stats(self):
+        """ The number of retries performed, and the number of requests that
+            failed even after exhausting their retries """
+        return {'retries': self.retried,
+                'exhausted': self.exhausted}
+
+    def _record(self, retried):
+        with self._lock:
+            if retried:
+                self.retried += 1
+            else:
+                self.exhausted += 1
+
+
+class _Retrier(object):
+    """ The retry state of a single request """
+
+    def __init__(self, policy):
+        self.policy = policy
+        self.remaining = policy.retries
+        self._poller = policy.backoff.start()
+
+    def retry(self, retry_after=None):
+        """ Wait before retrying a failed request; returns False (without
+            waiting) when no retries remain """
+        if self.remaining <= 0:
+            self.policy._record(False)
+            return False
+        self.remaining -= 1
+        self.policy._record(True)
+        self._poller.wait(retry_after=retry_after)
+        return True
+
+
+def _parse_retry_after(value, default):
+    """ Convert a Retry-After header (in seconds or an HTTP date) into a
+        delay in seconds """
+    try:
+        return max(float(value), 0)
+    except ValueError:
+        date = parsedate_tz(value)
+        return max(mktime_tz(date) - time.time(), 0) if date else default
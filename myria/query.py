@@ -3,7 +3,9 @@
 import time
 import requests
 import myria.plans
-from myria.relation import MyriaRelation
+from myria.connection import MyriaAsyncConnection
+from myria.relation import MyriaRelation, _to_dataframe
+from myria.schema import MyriaSchema
 
 try:
     from pandas.core.frame import DataFrame
@@ -16,6 +18,9 @@ class MyriaQuery(object):
 
     nonterminal_states = ['ACCEPTED', 'RUNNING']
 
+    # Widest range of query ids refreshed with a single listing request
+    max_listing_range = 1000
+
     def __init__(self, query_id, connection=None,
                  timeout=60, wait_for_completion=False):
         self.query_id = query_id
@@ -25,6 +30,9 @@ class MyriaQuery(object):
         self._name = None
         self._components = None
         self._qualified_name = None
+        self._schema = None
+        self._num_tuples = 0
+        self._completed = False
 
         if wait_for_completion:
             self.wait_for_completion()
@@ -54,7 +62,9 @@ class MyriaQuery(object):
     @staticmethod
     def parallel_import(relation, work, timeout=3600,
                         scan_type=None, scan_parameters=None,
-                        insert_type=None, insert_parameters=None):
+                        insert_type=None, insert_parameters=None,
+                        balance=False, sizes=None, partition_by=None,
+                        partition_function='Hash'):
         """ Submit a new parallel ingest plan to Myria
 
         relation: a MyriaRelation instance that receives the imported data
@@ -66,6 +76,15 @@ class MyriaQuery(object):
         scan_type: Reader parameters, e.g., {'readerType': 'CSV', "skip": 1}.
                 Schema is inserted into this.
         scan_parameters: Additional options to the TupleSource operator.
+        balance: reassign the uris to the same workers so as to balance the
+                 number of bytes each reads (see myria.plans.pack_work),
+                 using the given sizes or, by default, stat or HEAD
+                 requests.
+        partition_by: optional list of the names (or indexes) of columns by
+                      which the imported tuples are shuffled before they are
+                      stored, so that the relation is partitioned by them
+        partition_function: the function ('Hash' or 'Identity') applied to
+                            the partition_by columns
         """
         return MyriaQuery.submit_plan(
             myria.plans.get_parallel_import_plan(
@@ -76,10 +95,145 @@ class MyriaQuery(object):
                 scan_type=scan_type,
                 scan_parameters=scan_parameters,
                 insert_type=insert_type,
-                insert_parameters=insert_parameters),
+                insert_parameters=insert_parameters,
+                balance=balance,
+                sizes=sizes,
+                partitioning=MyriaQuery._get_partitioning(
+                    relation, partition_by, partition_function)),
             relation.connection,
             timeout)
 
+    @staticmethod
+    def parallel_import_files(relation, uris, workers=None, timeout=3600,
+                              scan_type=None, scan_parameters=None,
+                              insert_type=None, insert_parameters=None,
+                              delimiter='\n', partition_by=None,
+                              partition_function='Hash', split=False):
+        """ Submit a parallel ingest plan to Myria that balances the bytes
+        read by each worker
+
+        relation: a MyriaRelation instance that receives the imported data
+        uris: a sequence of local (file://) or http(s):// input URIs. The
+              size of each input is read by stat or a HEAD request.
+        workers: the ids of the workers that import data (defaults to all
+                 the workers that are alive)
+        split: also split (large) inputs into byte ranges, aligned to record
+               boundaries, read with the startRange and endRange of their
+               data sources. Only use this with a server whose data sources
+               support byte ranges; by default, each input is imported
+               whole, packed onto the workers by size (see
+               myria.plans.pack_work).
+        delimiter: the string that ends each record of the inputs, when
+                   they are split; inputs of unknown size are imported whole
+
+        The remaining arguments (including partition_by) are as for
+        parallel_import.
+        """
+        uris = list(uris)
+        workers = list(workers or relation.connection.workers_alive())
+        if not split:
+            return MyriaQuery.parallel_import(
+                relation,
+                [(workers[i % len(workers)], uri)
+                 for i, uri in enumerate(uris)],
+                timeout=timeout,
+                scan_type=scan_type,
+                scan_parameters=scan_parameters,
+                insert_type=insert_type,
+                insert_parameters=insert_parameters,
+                balance=True,
+                partition_by=partition_by,
+                partition_function=partition_function)
+
+        assignments = myria.plans.split_inputs(uris, workers,
+                                               delimiter=delimiter)
+        return MyriaQuery.submit_plan(
+            myria.plans.get_range_import_plan(
+                relation.schema,
+                assignments,
+                relation.qualified_name,
+                text='Parallel Import ' + str(uris),
+                scan_type=scan_type,
+                scan_parameters=scan_parameters,
+                insert_type=insert_type,
+                insert_parameters=insert_parameters,
+                partitioning=MyriaQuery._get_partitioning(
+                    relation, partition_by, partition_function)),
+            relation.connection,
+            timeout)
+
+    @staticmethod
+    def _get_partitioning(relation, columns, function):
+        """ The distribute function partitioning a relation by columns """
+        if not columns:
+            return None
+        return myria.plans.get_distribute_function(relation.schema, columns,
+                                                   function)
+
+    @staticmethod
+    def as_completed(queries, timeout=None):
+        """ Wait for a collection of queries, yielding each one as soon as
+        it reaches a terminal state
+
+        queries: an iterable of MyriaQuery instances
+        timeout: seconds to wait for every query to complete (defaults to the
+                 largest timeout of the given queries)
+
+        Rather than polling each query in turn, the statuses of all pending
+        queries on a connection are refreshed together, using a single query
+        listing request where possible.
+        """
+        pending = list(queries)
+        if not pending:
+            return
+
+        end = time.time() + (timeout or max(q.timeout for q in pending))
+        poller = pending[0].connection.polling.start()
+        while True:
+            MyriaQuery._refresh_status(pending)
+            for query in [q for q in pending
+                          if q._status not in q.nonterminal_states]:
+                pending.remove(query)
+                query._on_completed()
+                yield query
+
+            if not pending:
+                poller.finish()
+                return
+            elif time.time() >= end:
+                raise requests.Timeout()
+            poller.wait(deadline=end)
+
+    @staticmethod
+    def wait_all(queries, timeout=None):
+        """ Wait up to <timeout> seconds for all of the given queries to
+            complete, and return them """
+        queries = list(queries)
+        for _ in MyriaQuery.as_completed(queries, timeout):
+            pass
+        return queries
+
+    @staticmethod
+    def _refresh_status(queries):
+        """ Update the status of each query, grouping queries by connection
+            and fetching their statuses with one listing request per group """
+        connections = {}
+        for query in queries:
+            connections.setdefault(query.connection, []).append(query)
+
+        for connection, group in connections.items():
+            ids = [int(q.query_id) for q in group]
+            statuses = {}
+            if len(group) > 1 and \
+                    max(ids) - min(ids) < MyriaQuery.max_listing_range:
+                listing = connection.queries(limit=max(ids) - min(ids) + 1,
+                                             max_id=max(ids))
+                statuses = dict((int(s['queryId']), s['status'])
+                                for s in listing.get('results', []))
+            for query in group:
+                query._status = statuses.get(int(query.query_id)) or \
+                    connection.get_query_status(query.query_id)['status']
+
     @property
     def name(self):
         """ The name assigned to this query, if any """
@@ -117,15 +271,36 @@ class MyriaQuery(object):
         return self.connection.download_dataset(self.qualified_name, limit) \
             if self.qualified_name else None
 
-    def to_dataframe(self, index=None, limit=None):
+    def to_iterator(self, limit=None, batch_size=None):
+        """ Download the results of the query as an iterator of tuples,
+            optionally grouped into lists of batch_size tuples """
+        self.wait_for_completion()
+        return self.connection.stream_dataset(self.qualified_name,
+                                              limit=limit,
+                                              batch_size=batch_size) \
+            if self.qualified_name else iter([])
+
+    def to_array(self, limit=None):
+        """ Download the all-numeric query result as a NumPy record array """
+        self.wait_for_completion()
+        return self.connection.download_array(self.qualified_name,
+                                              self._schema.to_dict(),
+                                              limit=limit) \
+            if self.qualified_name else None
+
+    def to_dataframe(self, index=None, limit=None, categorical=False):
         """ Convert the query result to a Pandas DataFrame """
         if not DataFrame:
             raise ImportError('Must execute `pip install pandas` to generate '
                               'Pandas DataFrames')
+        elif not self.qualified_name:
+            return None
         else:
-            values = self.to_dict(limit)
-            return DataFrame.from_records(values, index=index) \
-                if values else None
+            dataframe = _to_dataframe(
+                self.to_iterator(limit), self._schema,
+                min(self._num_tuples, limit) if limit else self._num_tuples,
+                index=index, categorical=categorical)
+            return dataframe if len(dataframe) else None
 
     def _repr_html_(self, limit=None):
         """ Generate a representation of this query as HTML """
@@ -142,18 +317,43 @@ class MyriaQuery(object):
     def wait_for_completion(self, timeout=None):
         """ Wait up to <timeout> seconds for the query to complete """
         end = time.time() + (timeout or self.timeout)
+        poller = self.connection.polling.start()
         while self.status in self.nonterminal_states:
             if time.time() >= end:
                 raise requests.Timeout()
-            time.sleep(1)
+            poller.wait(deadline=end)
+        poller.finish()
         self._on_completed()
         return self
 
+    def wait_for_completion_async(self, timeout=None):
+        """ Wait for the query to complete on a background thread; returns
+            an AsyncResult that resolves to this query """
+        return MyriaAsyncConnection(self.connection).submit(
+            self.wait_for_completion, timeout)
+
+    def to_dict_async(self, limit=None):
+        """ Download the JSON results of the query on a background thread;
+            returns an AsyncResult that resolves to the results """
+        return MyriaAsyncConnection(self.connection).submit(self.to_dict,
+                                                            limit)
+
     def _on_completed(self):
-        """ Load query metadata after query completion """
+        """ Load query metadata after query completion, the first time it
+            is observed """
+        if self._completed:
+            return
         dataset = self.connection._wrap_get('/dataset',
                                             params={'queryId': self.query_id})
+        # The query may have written any relation, and its outputs are
+        # listed here in full
+        self.connection.invalidate_metadata()
+        for metadata in dataset:
+            self.connection.cache_metadata(metadata['relationKey'], metadata)
         if len(dataset):
             self._qualified_name = dataset[0]['relationKey']
+            self._schema = MyriaSchema(dataset[0]['schema'])
+            self._num_tuples = max(int(dataset[0]['numTuples']), 0)
             self._name = MyriaRelation._get_name(self._qualified_name)
             self._components = MyriaRelation._get_name_components(self._name)
+        self._completed = True
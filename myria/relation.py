@@ -1,16 +1,81 @@
 """ Higher-level types for interacting with Myria relations """
 
-from itertools import izip
+from collections import OrderedDict, deque
+from itertools import izip, islice
+from multiprocessing.pool import ThreadPool
+from uuid import uuid4
 from dateutil.parser import parse
+import myria.plans
 from myria import MyriaConnection, MyriaError
+from myria.connection import MyriaAsyncConnection, _iter_batches
 from myria.schema import MyriaSchema
 from myria.fluent import MyriaFluentQuery
 
 try:
+    import numpy
+    import pandas
     from pandas.core.frame import DataFrame
 except ImportError:
     DataFrame = None
 
+# The number of tuples decoded into DataFrame columns at a time
+DATAFRAME_BATCH_SIZE = 4096
+
+
+def _to_dataframe(tuples, schema, size=0, index=None, categorical=False):
+    """ Decode tuples directly into preallocated columns typed by schema
+
+    tuples: an iterable of tuples, each either a sequence of values or a
+            dict keyed by attribute name
+    schema: the MyriaSchema describing the tuples
+
+    Keyword arguments:
+    size: the expected number of tuples; columns grow if it is exceeded
+    index: attribute (or list of attributes) to use as the index
+    categorical: store string attributes as Pandas categoricals
+    """
+    size = max(size, 0)
+    columns = [numpy.empty(size, dtype=object
+                           if dtype.startswith('datetime') else dtype)
+               for dtype in schema.dtypes]
+    count = 0
+
+    # Fill the columns a batch at a time, so that each column is converted
+    # and copied by NumPy rather than one value at a time
+    for batch in _iter_batches(tuples, DATAFRAME_BATCH_SIZE):
+        if isinstance(batch[0], dict):
+            batch = [[values[name] for name in schema.names]
+                     for values in batch]
+        length = len(batch)
+        if count + length > size:
+            size = max(2 * size, count + length, 1024)
+            for column in columns:
+                column.resize(size, refcheck=False)
+        for i, values in enumerate(izip(*batch)):
+            column = columns[i]
+            if column.dtype.kind in 'iufb' and None not in values:
+                column[count:count + length] = numpy.fromiter(
+                    values, column.dtype, length)
+                continue
+            # Integer and boolean columns cannot represent nulls
+            if column.dtype.kind in 'iub':
+                column = columns[i] = column.astype(
+                    object if column.dtype.kind == 'b' else 'float64')
+            column[count:count + length] = values
+        count += length
+
+    data = OrderedDict()
+    for name, type_, column in izip(schema.names, schema.types, columns):
+        column = column[:count]
+        if type_ == 'DATETIME_TYPE':
+            column = pandas.to_datetime(column)
+        elif type_ == 'STRING_TYPE' and categorical:
+            column = pandas.Categorical(column)
+        data[name] = column
+
+    dataframe = DataFrame(data)
+    return dataframe.set_index(index) if index is not None else dataframe
+
 
 class MyriaRelation(MyriaFluentQuery):
     """ Represents a relation in the Myria system """
@@ -39,7 +104,6 @@ class MyriaRelation(MyriaFluentQuery):
         self.connection = connection or self.DefaultConnection
         self.qualified_name = self._get_qualified_name(self.components)
         self._schema = None
-        self._metadata = None
         self.load = self.instance_load
 
         # If the relation is already persisted, any schema parameter
@@ -88,18 +152,95 @@ class MyriaRelation(MyriaFluentQuery):
                                                 limit=limit) \
             if self.is_persisted else []
 
+    def to_iterator(self, limit=None, batch_size=None, parallelism=None):
+        """ Download this relation as an iterator of tuples, optionally
+            grouped into lists of batch_size tuples.  When parallelism is
+            specified, the partition stored on each worker is downloaded
+            separately using up to that many concurrent requests. """
+        if not self.is_persisted:
+            return iter([])
+        elif parallelism:
+            tuples = islice(self._download_partitions(parallelism), limit)
+            return _iter_batches(tuples, batch_size) if batch_size else tuples
+        else:
+            return self.connection.stream_dataset(self.qualified_name,
+                                                  limit=limit,
+                                                  batch_size=batch_size)
+
+    def _download_partitions(self, parallelism):
+        """ Copy the partition stored on each worker into a temporary
+            relation, stream those relations concurrently, and yield
+            their tuples in worker order """
+        from myria.query import MyriaQuery
+
+        workers = sorted(set(
+            self.metadata.get('howDistributed', {}).get('workers') or
+            self.connection.workers_alive()))
+        token = uuid4().hex[:8]
+        partitions = [self._get_qualified_name(
+            self.components[:2] +
+            ['{}__partition_{}_{}'.format(self.components[2], token, worker)])
+            for worker in workers]
+
+        # At most parallelism partitions are downloaded at a time, each
+        # buffering a bounded number of batches ahead of the consumer
+        pool = ThreadPool(parallelism)
+        background = MyriaAsyncConnection(self.connection, pool=pool)
+        pending = iter(partitions)
+        streams = deque()
+        try:
+            query = MyriaQuery.submit_plan(
+                myria.plans.get_partition_plan(
+                    self.qualified_name, zip(workers, partitions),
+                    text='Partition ' + self.name),
+                self.connection, timeout=3600).wait_for_completion()
+            if query.status != 'SUCCESS':
+                raise MyriaError('Failed to partition {}: {}'.format(
+                    self.name, query.status))
+
+            while True:
+                for partition in islice(pending, parallelism - len(streams)):
+                    streams.append(background.stream_dataset(partition))
+                if not streams:
+                    break
+                for batch in streams[0]:
+                    for t in batch:
+                        yield t
+                streams.popleft()
+        finally:
+            for stream in streams:
+                stream.close()
+            pool.terminate()
+            # Some partitions may never have been created
+            for partition in partitions:
+                try:
+                    self.connection.delete_dataset(partition)
+                except MyriaError:
+                    pass
+
+    def to_array(self, limit=None):
+        """ Download this all-numeric relation as a NumPy record array """
+        return self.connection.download_array(self.qualified_name,
+                                              self.schema.to_dict(),
+                                              limit=limit)
+
     def delete(self):
         """ Delete this relation"""
         self.connection.delete_dataset(self.qualified_name)
-        self._metadata = None
 
-    def to_dataframe(self, index=None, limit=None):
+    def to_dataframe(self, index=None, limit=None, categorical=False,
+                     parallelism=None):
         """ Convert the query result to a Pandas DataFrame """
         if not DataFrame:
             raise ImportError('Must execute `pip install pandas` to generate '
                               'Pandas DataFrames')
         else:
-            return DataFrame.from_records(self.to_dict(limit), index=index)
+            size = len(self) if self.is_persisted else 0
+            return _to_dataframe(self.to_iterator(limit,
+                                                  parallelism=parallelism),
+                                 self.schema,
+                                 min(size, limit) if limit else size,
+                                 index=index, categorical=categorical)
 
     def _repr_html_(self, limit=None):
         """ Generate a representation of this query as HTML """
@@ -127,10 +268,9 @@ class MyriaRelation(MyriaFluentQuery):
 
     @property
     def metadata(self):
-        """ A JSON dictionary of relation metadata """
-        if self._metadata is None:
-            self._metadata = self.connection.dataset(self.qualified_name)
-        return self._metadata
+        """ A JSON dictionary of relation metadata, cached by the connection
+            until it expires or the relation is written """
+        return self.connection.dataset(self.qualified_name)
 
     @property
     def is_persisted(self):
@@ -3,6 +3,29 @@
 SCHEMA_TYPES = ['INT_TYPE', 'FLOAT_TYPE', 'DOUBLE_TYPE', 'BOOLEAN_TYPE',
                 'STRING_TYPE', 'LONG_TYPE', 'DATETIME_TYPE', 'BLOB_TYPE']
 
+# Types that may be packed into fixed-width binary records
+NUMERIC_TYPES = ['INT_TYPE', 'LONG_TYPE', 'FLOAT_TYPE', 'DOUBLE_TYPE']
+
+# Python struct markers for the packed binary encoding of each fixed-width
+# type. Datetimes are encoded as milliseconds since the epoch, and strings
+# (which are not fixed-width) as their length followed by their UTF-8 bytes.
+STRUCT_FORMATS = {'INT_TYPE': 'i',
+                  'LONG_TYPE': 'q',
+                  'FLOAT_TYPE': 'f',
+                  'DOUBLE_TYPE': 'd',
+                  'BOOLEAN_TYPE': '?',
+                  'DATETIME_TYPE': 'q'}
+
+# NumPy dtypes used to hold each type when decoding a relation
+DTYPES = {'INT_TYPE': 'int32',
+          'LONG_TYPE': 'int64',
+          'FLOAT_TYPE': 'float32',
+          'DOUBLE_TYPE': 'float64',
+          'BOOLEAN_TYPE': 'bool',
+          'DATETIME_TYPE': 'datetime64[ns]',
+          'STRING_TYPE': 'object',
+          'BLOB_TYPE': 'object'}
+
 
 class MyriaSchema(object):
     """ Represents a schema for a Myria relation """
@@ -30,6 +53,11 @@ class MyriaSchema(object):
     def __ne__(self, other):
         return not self == other
 
+    @property
+    def dtypes(self):
+        """ The NumPy dtype names corresponding to each attribute """
+        return [DTYPES[type_] for type_ in self.types]
+
     def to_dict(self):
         """ Convert this schema instance to JSON """
         return {'columnNames': self.names,
@@ -83,6 +83,12 @@ def create_mock(state=None):
                 'content': MyriaPythonFunction(
                     lambda i: 0, UDF2_TYPE, UDF2_NAME, False).to_dict()}
 
+        elif url.path.startswith('/function/') and request.method == 'GET':
+            name = url.path[len('/function/'):]
+            if name in state:
+                return {'status_code': 200, 'content': state[name]}
+            return {'status_code': 404}
+
         elif url.path == '/function' and request.method == 'POST':
             body = json.loads(request.body)
             state[body['name']] = body
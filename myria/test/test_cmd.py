@@ -1,10 +1,17 @@
+from datetime import datetime
 from httmock import urlmatch, HTTMock
 from json import dumps as jstr, loads
 from myria.cmd import upload_file
 from myria.errors import MyriaError
 from nose.tools import eq_, assert_raises
+from messytables import DecimalType, IntegerType
 from scripttest import TestFileEnvironment
+from StringIO import StringIO
+from struct import pack
+import os
+import shutil
 import sys
+import tempfile
 
 
 class NullWriter:
@@ -176,6 +183,193 @@ class TestCmd():
                               'testdata/de.txt'])
 
 
+class TestSampledStream():
+    DATA = ''.join('{},{}\n'.format(i, i * i) for i in xrange(1000))
+
+    def test_reread_sample(self):
+        stream = upload_file.SampledStream(StringIO(self.DATA), 100)
+        eq_(stream.read(50), self.DATA[:50])
+        stream.seek(0)
+        eq_(stream.readline(), '0,0\n')
+        eq_(stream.read(150), self.DATA[4:154])
+        eq_(stream.tell(), 154)
+        eq_(stream.readline() + stream.read(), self.DATA[154:])
+
+    def test_seek_past_sample(self):
+        stream = upload_file.SampledStream(StringIO(self.DATA), 100)
+        eq_(list(stream), self.DATA.splitlines(True))
+        with assert_raises(IOError):
+            stream.seek(0)
+
+    def test_stdin(self):
+        data = ''.join('{},x{}\n'.format(i, i) for i in xrange(10000))
+        stdin, stdout = sys.stdin, sys.stdout
+        sys.stdin, sys.stdout = StringIO(data), StringIO()
+        try:
+            upload_file.main(['--relation', 'stdin', '--dry'])
+            eq_(sys.stdout.getvalue(), data.replace('\n', '\r\n'))
+        finally:
+            sys.stdin, sys.stdout = stdin, stdout
+
+
+class TestWriteBinary():
+    SCHEMA = {'columnTypes': ['LONG_TYPE', 'DOUBLE_TYPE'],
+              'columnNames': ['a', 'b']}
+    TYPES = [IntegerType(), DecimalType()]
+
+    def row_set(self, data):
+        return upload_file.any_tableset(StringIO(data)).tables[0]
+
+    def expected(self, rows):
+        return ''.join(pack('<qd', *row) for row in rows)
+
+    def test_vectorized(self):
+        rows = [(i, i / 4.0) for i in xrange(10000)]
+        data = ''.join('{},{}\n'.format(*row) for row in rows)
+        eq_(''.join(upload_file.write_binary(
+            self.row_set(data), self.SCHEMA, self.TYPES)),
+            self.expected(rows))
+
+    def test_without_numpy(self):
+        numpy, upload_file.numpy = upload_file.numpy, None
+        try:
+            eq_(''.join(upload_file.write_binary(
+                self.row_set('1,2.5\n3,4\n'), self.SCHEMA, self.TYPES)),
+                self.expected([(1, 2.5), (3, 4)]))
+        finally:
+            upload_file.numpy = numpy
+
+    def test_fallback(self):
+        # numpy does not parse '3.0' as an integer, but messytables does
+        eq_(''.join(upload_file.write_binary(
+            self.row_set('1,2.5\n3.0,4\n'), self.SCHEMA, self.TYPES)),
+            self.expected([(1, 2.5), (3, 4)]))
+
+
+class TestBinaryRecords():
+    DATA = ('name,flag,day,count\n'
+            'abcde,true,2015-01-02,0\n'
+            'b,false,1970-01-01,1\n')
+
+    def test_encoder(self):
+        encode = upload_file.record_encoder(
+            {'columnTypes': ['STRING_TYPE', 'BOOLEAN_TYPE', 'DATETIME_TYPE',
+                             'LONG_TYPE']})
+        eq_(encode([u'caf\xe9', True, datetime(2015, 1, 2, 0, 0, 1, 2000),
+                    7]),
+            pack('<i5s?qq', 5, 'caf\xc3\xa9', True, 1420156801002, 7))
+
+    def test_guess(self):
+        row_set, types, headers = upload_file.load_row_set(
+            StringIO(self.DATA), binary=True)
+        eq_(upload_file.messy_to_schema(types, headers)['columnTypes'],
+            ['STRING_TYPE', 'BOOLEAN_TYPE', 'DATETIME_TYPE', 'LONG_TYPE'])
+
+        _, types, _ = upload_file.load_row_set(StringIO(self.DATA))
+        eq_(upload_file.messy_to_schema(types)['columnTypes'],
+            ['STRING_TYPE', 'STRING_TYPE', 'STRING_TYPE', 'LONG_TYPE'])
+
+    def test_write(self):
+        row_set, types, headers = upload_file.load_row_set(
+            StringIO(self.DATA), binary=True)
+        schema = upload_file.messy_to_schema(types, headers)
+        data, kwargs = upload_file.write_data(row_set, schema, types,
+                                              binary=True)
+        eq_(kwargs, {'binary': True, 'is_little_endian': True})
+        eq_(''.join(data),
+            pack('<i5s?qq', 5, 'abcde', True, 1420156800000, 0) +
+            pack('<i1s?qq', 1, 'b', False, 0, 1))
+
+
+class TestMultipleFiles():
+    def setup(self):
+        self.directory = tempfile.mkdtemp()
+        self.uploads = []
+        self.plans = []
+        self.deleted = []
+        self.status = 'SUCCESS'
+        for day in range(3):
+            with open(os.path.join(self.directory,
+                                   'day{}.csv'.format(day)), 'w') as f:
+                f.write('src,dst\n')
+                f.writelines('{},{}\n'.format(day, i) for i in range(100))
+
+        @urlmatch(netloc=r'localhost:12345')
+        def mock(url, request):
+            if url.path == '/dataset':
+                fields = dict(request.body.fields)
+                eq_(get_field(fields, 'schema')['columnTypes'],
+                    ['LONG_TYPE', 'LONG_TYPE'])
+                self.uploads.append(
+                    (get_field(fields, 'relationKey')['relationName'],
+                     ''.join(request.body)))
+            elif url.path == '/query':
+                self.plans.append(loads(request.body))
+                return jstr({'status': self.status})
+            elif request.method == 'DELETE':
+                self.deleted.append(url.path)
+            return jstr('ok')
+        self.mock = mock
+
+    def teardown(self):
+        shutil.rmtree(self.directory)
+
+    def test_expand_paths(self):
+        paths = [os.path.join(self.directory, 'day{}.csv'.format(day))
+                 for day in range(3)]
+        eq_(upload_file.expand_paths([self.directory]), paths)
+        eq_(upload_file.expand_paths([os.path.join(self.directory, '*')]),
+            paths)
+        with assert_raises(IOError):
+            upload_file.expand_paths([os.path.join(self.directory, 'x*')])
+
+    def test_directory(self):
+        with HTTMock(self.mock):
+            upload_file.main(['--relation', 'days', '--jobs', '1',
+                              '--hostname', 'localhost', '--port', '12345',
+                              self.directory])
+        eq_(len(self.uploads), 3)
+        for day, (name, body) in enumerate(self.uploads):
+            assert name.startswith('days__part_')
+            assert pack('<qq', day, 99) in body
+
+        operators = self.plans[0]['fragments'][0]['operators']
+        eq_([op['relationKey']['relationName'] for op in operators
+             if op['opType'] == 'TableScan'],
+            [name for name, _ in self.uploads])
+        eq_(operators[-1]['relationKey']['relationName'], 'days')
+
+    def test_failed_commit(self):
+        self.status = 'ERROR'
+        with HTTMock(self.mock):
+            with assert_raises(MyriaError):
+                upload_file.main(['--relation', 'days', '--jobs', '1',
+                                  '--hostname', 'localhost',
+                                  '--port', '12345', self.directory])
+        # The staging relations are removed
+        eq_(len(self.deleted), 3)
+        for (name, _), path in zip(self.uploads, self.deleted):
+            assert path.endswith('/relation-' + name)
+
+    def test_processes(self):
+        with HTTMock(self.mock):
+            upload_file.main(['--relation', 'days', '--jobs', '3',
+                              '--hostname', 'localhost', '--port', '12345',
+                              os.path.join(self.directory, '*.csv')])
+        operators = self.plans[0]['fragments'][0]['operators']
+        eq_(len(operators), 5)
+
+    def test_inconsistent(self):
+        with open(os.path.join(self.directory, 'day3.csv'), 'w') as f:
+            f.write('source,destination\n1,2\n')
+        with HTTMock(self.mock):
+            with assert_raises(ValueError):
+                upload_file.main(['--relation', 'days', '--jobs', '1',
+                                  '--hostname', 'localhost',
+                                  '--port', '12345', self.directory])
+        eq_(self.plans, [])
+
+
 def get_field(fields, name):
     (name, value, content_type) = fields[name]
     if content_type == 'application/json':
@@ -1,7 +1,27 @@
 from httmock import urlmatch, HTTMock
+from StringIO import StringIO
+import base64
 import json
+from multiprocessing.pool import ThreadPool
+import os
+import re
+import shutil
+import socket
+import tempfile
+import time
+import zlib
 import unittest
-from myria import MyriaConnection
+from myria import MyriaConnection, MyriaAsyncConnection
+from myria.errors import MyriaError
+from myria.polling import PollingStrategy, RetryPolicy
+import requests
+from myria.connection import _iter_json_array, _compress, _decompress, \
+    _parse_csv_array
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
 
 
 @urlmatch(netloc=r'localhost:12345')
@@ -9,6 +29,10 @@ def local_mock(url, request):
     ret = None
     if url.path == '/workers':
         ret = {'1': 'localhost:12347', '2': 'localhost:12348'}
+    elif url.path == '/dataset/user-public/program-adhoc/relation-r/data':
+        ret = [[i] for i in xrange(10)]
+    elif url.path == '/dataset/user-public/program-adhoc/relation-bad/data':
+        return {'status_code': 200, 'content': '[[1], [2'}
 
     return json.dumps(ret)
 
@@ -40,3 +64,613 @@ class TestDeployment(unittest.TestCase):
 
             self.assertEquals(connection.workers(),
                               {'1': 'localhost:12347', '2': 'localhost:12348'})
+
+
+class TestConnectionPool(unittest.TestCase):
+    def test_pool_size(self):
+        connection = MyriaConnection(hostname='localhost', port=12345,
+                                     pool_connections=3, pool_maxsize=7)
+        for scheme in ['http://', 'https://']:
+            adapter = connection._session.get_adapter(scheme + 'localhost')
+            self.assertEquals(adapter._pool_connections, 3)
+            self.assertEquals(adapter._pool_maxsize, 7)
+
+    def test_keep_alive(self):
+        connection = MyriaConnection(hostname='localhost', port=12345)
+        adapter = connection._session.get_adapter('http://localhost')
+        options = adapter.poolmanager.connection_pool_kw['socket_options']
+        self.assertIn((socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1), options)
+
+    def test_timeout(self):
+        requests = []
+
+        def request(method, url, **kwargs):
+            requests.append(kwargs)
+            raise Exception('Not sent')
+
+        connection = MyriaConnection(hostname='localhost', port=12345,
+                                     timeout=(1, 5))
+        connection._session.request = request
+        for method in [connection.workers,
+                       lambda: connection.get_query_status(1),
+                       lambda: connection.execute_query({})]:
+            self.assertRaises(Exception, method)
+        self.assertEquals(len(requests), 3)
+        for kwargs in requests:
+            self.assertEquals(kwargs['timeout'], (1, 5))
+
+
+class FlakyResponse(object):
+    """A streaming response whose connection fails after some chunks"""
+    def __init__(self, chunks, *failures):
+        self.chunks = chunks
+        self.failures = failures
+        self.closed = False
+
+    def iter_content(self, chunk_size=None):
+        for chunk in self.chunks:
+            yield chunk
+        for failure in self.failures:
+            raise failure
+
+    def close(self):
+        self.closed = True
+
+
+class TestRetry(unittest.TestCase):
+    def setUp(self):
+        self.requests = []
+        self.failures = 0
+
+        @urlmatch(netloc=r'localhost:12345')
+        def flaky_mock(url, request):
+            self.requests.append(request.method)
+            if len(self.requests) <= self.failures:
+                return {'status_code': 503, 'content': 'Unavailable'}
+            return json.dumps({'queryId': 5, 'status': 'SUCCESS'})
+
+        self.mock = flaky_mock
+        self.connection = MyriaConnection(
+            hostname='localhost', port=12345,
+            retry=RetryPolicy(retries=2,
+                              backoff=PollingStrategy(initial=0.001)))
+
+    def test_retry_get(self):
+        self.failures = 2
+        with HTTMock(self.mock):
+            status = self.connection.get_query_status(5)
+            self.assertEquals(status['status'], 'SUCCESS')
+            self.assertEquals(self.requests, ['GET'] * 3)
+            self.assertEquals(self.connection.retry.stats,
+                              {'retries': 2, 'exhausted': 0})
+
+    def test_retries_exhausted(self):
+        self.failures = 3
+        with HTTMock(self.mock):
+            self.assertRaises(MyriaError,
+                              self.connection.get_query_status, 5)
+            self.assertEquals(len(self.requests), 3)
+            self.assertEquals(self.connection.retry.stats,
+                              {'retries': 2, 'exhausted': 1})
+
+    def test_no_retry_post(self):
+        self.failures = 1
+        with HTTMock(self.mock):
+            self.assertRaises(MyriaError, self.connection.submit_query, {})
+            self.assertEquals(self.requests, ['POST'])
+            self.assertEquals(self.connection.retry.stats['retries'], 0)
+
+    def test_retry_download(self):
+        responses = [FlakyResponse(['[[1'],
+                                   requests.ConnectionError('reset')),
+                     FlakyResponse(['[[1], [2], [3]]'])]
+        self.connection._make_request = \
+            lambda *args, **kwargs: responses.pop(0)
+        first = responses[0]
+
+        tuples = self.connection.stream_dataset(
+            {'userName': 'public', 'programName': 'adhoc',
+             'relationName': 'r'})
+        self.assertEquals(list(tuples), [[1], [2], [3]])
+        self.assertTrue(first.closed)
+        self.assertEquals(self.connection.retry.stats['retries'], 1)
+
+    def test_interrupted_download(self):
+        # Tuples may be downloaded in a different order, so a download is
+        # not resumed once some tuples have been delivered
+        responses = [FlakyResponse(['[[1], [2'],
+                                   requests.ConnectionError('reset')),
+                     FlakyResponse(['[[2], [1]]'])]
+        self.connection._make_request = \
+            lambda *args, **kwargs: responses.pop(0)
+
+        tuples = self.connection.stream_dataset(
+            {'userName': 'public', 'programName': 'adhoc',
+             'relationName': 'r'})
+        self.assertEquals(next(tuples), [1])
+        self.assertRaises(MyriaError, next, tuples)
+        self.assertEquals(len(responses), 1)
+        self.assertEquals(self.connection.retry.stats['retries'], 0)
+
+    def test_failed_download(self):
+        responses = [FlakyResponse(['[[1'], requests.ConnectionError('reset'))
+                     for _ in xrange(3)]
+        self.connection._make_request = \
+            lambda *args, **kwargs: responses.pop(0)
+
+        tuples = self.connection.stream_dataset(
+            {'userName': 'public', 'programName': 'adhoc',
+             'relationName': 'r'})
+        self.assertRaises(MyriaError, list, tuples)
+        self.assertEquals(self.connection.retry.stats,
+                          {'retries': 2, 'exhausted': 1})
+
+
+class TestUpload(unittest.TestCase):
+    RELATION_KEY = {'userName': 'public',
+                    'programName': 'adhoc',
+                    'relationName': 'r'}
+    SCHEMA = {'columnNames': ['a'], 'columnTypes': ['LONG_TYPE']}
+    DATA = '\n'.join(str(i) for i in xrange(10000))
+
+    def setUp(self):
+        self.uploads = []
+
+        @urlmatch(netloc=r'localhost:12345', path='/dataset')
+        def upload_mock(url, request):
+            if isinstance(request.body, basestring):
+                body = request.body
+            elif hasattr(request.body, 'read'):
+                body = request.body.read()
+            else:
+                body = ''.join(request.body)
+            self.uploads.append((request.headers['Content-Type'], body))
+            return json.dumps({'relationKey': self.RELATION_KEY})
+
+        self.mock = upload_mock
+        self.connection = MyriaConnection(hostname='localhost', port=12345)
+
+    def test_upload_fp(self):
+        with HTTMock(self.mock):
+            self.connection.upload_fp(self.RELATION_KEY, self.SCHEMA,
+                                      StringIO(self.DATA), overwrite=True)
+            content_type, body = self.uploads[0]
+            self.assertTrue(content_type.startswith('multipart/form-data'))
+            self.assertIn(self.DATA, body)
+            self.assertIn(json.dumps(self.SCHEMA), body)
+            self.assertNotIn(base64.b64encode(self.DATA), body)
+
+    def test_progress(self):
+        progress = []
+        with HTTMock(self.mock):
+            self.connection.upload_fp(
+                self.RELATION_KEY, self.SCHEMA, StringIO(self.DATA),
+                progress=lambda sent, total: progress.append((sent, total)))
+            total = len(self.uploads[0][1])
+            self.assertEquals(progress[-1], (total, total))
+            self.assertListEqual(progress, sorted(progress))
+
+    def test_upload_iterable(self):
+        chunks = (line + '\n' for line in self.DATA.split('\n'))
+        progress = []
+        with HTTMock(self.mock):
+            self.connection.upload_file(
+                self.RELATION_KEY, self.SCHEMA, chunks,
+                progress=lambda sent, total: progress.append((sent, total)))
+            content_type, body = self.uploads[0]
+            self.assertTrue(content_type.startswith('multipart/form-data'))
+            self.assertIn(self.DATA + '\n', body)
+            self.assertIn(json.dumps(self.SCHEMA), body)
+            self.assertTrue(body.endswith('--\r\n'))
+            self.assertEquals(progress[-1], (len(body), None))
+
+    def test_base64(self):
+        with HTTMock(self.mock):
+            self.connection.upload_fp(self.RELATION_KEY, self.SCHEMA,
+                                      StringIO(self.DATA), use_base64=True)
+            content_type, body = self.uploads[0]
+            self.assertEquals(content_type, 'application/json')
+            self.assertEquals(json.loads(body)['source'],
+                              {'dataType': 'Bytes',
+                               'bytes': base64.b64encode(self.DATA)})
+
+
+class TestChunkedUpload(unittest.TestCase):
+    RELATION_KEY = TestUpload.RELATION_KEY
+    SCHEMA = TestUpload.SCHEMA
+    DATA = TestUpload.DATA
+
+    def setUp(self):
+        self.parts = {}
+        self.uploads = 0
+        self.plans = []
+        self.deleted = []
+        self.failures = 0
+        self.directory = tempfile.mkdtemp()
+
+        @urlmatch(netloc=r'localhost:12345')
+        def chunked_mock(url, request):
+            if url.path == '/dataset' and request.method == 'POST':
+                body = request.body.read()
+                name = re.search(r'"relationName": "([^"]+)"', body).group(1)
+                if self.failures and len(self.parts) == 2:
+                    self.failures -= 1
+                    return {'status_code': 500, 'content': 'Failed'}
+                start = body.index('\r\n\r\n', body.index('name="data"'))
+                self.parts[name] = body[start + 4:body.rindex('\r\n--')]
+                self.uploads += 1
+                return json.dumps({'relationKey': self.RELATION_KEY})
+            elif url.path == '/query':
+                self.plans.append(json.loads(request.body))
+                return json.dumps({'status': 'SUCCESS'})
+            elif request.method == 'DELETE':
+                self.deleted.append(url.path)
+                return {'status_code': 204, 'content': ''}
+            return json.dumps({'relationKey': self.RELATION_KEY})
+
+        self.mock = chunked_mock
+        self.connection = MyriaConnection(hostname='localhost', port=12345)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def committed(self):
+        operators = self.plans[-1]['fragments'][0]['operators']
+        return [self.parts[scan['relationKey']['relationName']]
+                for scan in operators if scan['opType'] == 'TableScan']
+
+    def test_chunked(self):
+        with HTTMock(self.mock):
+            self.connection.upload_file(self.RELATION_KEY, self.SCHEMA,
+                                        self.DATA, chunk_size=4096)
+        self.assertGreater(len(self.parts), 1)
+        self.assertEquals(''.join(self.committed()), self.DATA)
+        for part in self.committed()[:-1]:
+            self.assertTrue(part.endswith('\n'))
+        self.assertEquals(len(self.deleted), len(self.parts))
+
+        insert = self.plans[-1]['fragments'][0]['operators'][-1]
+        self.assertEquals(insert['relationKey'], self.RELATION_KEY)
+        self.assertFalse(insert['argOverwriteTable'])
+
+    def test_binary_alignment(self):
+        with HTTMock(self.mock):
+            self.connection.upload_file(self.RELATION_KEY, self.SCHEMA,
+                                        StringIO('\0' * 800), binary=True,
+                                        chunk_size=100)
+        for part in self.committed():
+            self.assertEquals(len(part) % 8, 0)
+
+    def test_binary_fixed_width(self):
+        schema = {'columnNames': ['a'], 'columnTypes': ['STRING_TYPE']}
+        self.assertRaises(MyriaError, self.connection.upload_file,
+                          self.RELATION_KEY, schema, 'abc', binary=True,
+                          chunk_size=100)
+
+    def test_failed_part(self):
+        self.failures = 100
+        with HTTMock(self.mock):
+            self.assertRaises(MyriaError, self.connection.upload_file,
+                              self.RELATION_KEY, self.SCHEMA, self.DATA,
+                              chunk_size=4096, parallelism=1)
+        # The rest of the input is not uploaded after the third part fails
+        self.assertEquals(self.failures, 99)
+        self.assertEquals(self.uploads, 2)
+        self.assertEquals(self.plans, [])
+        # and the staging relations are removed
+        for name in self.parts:
+            self.assertIn('/relation-' + name,
+                          [path[path.rindex('/'):]
+                           for path in self.deleted])
+
+    def test_resume(self):
+        manifest = os.path.join(self.directory, 'manifest.json')
+        self.failures = 1
+        with HTTMock(self.mock):
+            self.assertRaises(MyriaError, self.connection.upload_file,
+                              self.RELATION_KEY, self.SCHEMA, self.DATA,
+                              chunk_size=4096, parallelism=1,
+                              manifest=manifest)
+            self.assertTrue(os.path.exists(manifest))
+            self.assertEquals(self.plans, [])
+            # The uploaded parts are kept to resume from
+            self.assertEquals(self.deleted, [])
+
+            uploads = self.uploads
+            self.connection.upload_file(self.RELATION_KEY, self.SCHEMA,
+                                        self.DATA, chunk_size=4096,
+                                        parallelism=1, manifest=manifest,
+                                        overwrite=True)
+        self.assertEquals(''.join(self.committed()), self.DATA)
+        self.assertFalse(os.path.exists(manifest))
+        insert = self.plans[-1]['fragments'][0]['operators'][-1]
+        self.assertTrue(insert['argOverwriteTable'])
+        # The parts uploaded before the failure are not uploaded again
+        self.assertEquals(uploads, 2)
+        self.assertEquals(self.uploads, len(self.parts))
+
+    def test_changed_input(self):
+        manifest = os.path.join(self.directory, 'manifest.json')
+        path = os.path.join(self.directory, 'data.csv')
+        with open(path, 'w') as f:
+            f.write(self.DATA)
+        self.failures = 1
+        with HTTMock(self.mock):
+            with open(path) as f:
+                self.assertRaises(MyriaError, self.connection.upload_file,
+                                  self.RELATION_KEY, self.SCHEMA, f,
+                                  chunk_size=4096, parallelism=1,
+                                  manifest=manifest)
+
+            with open(path, 'a') as f:
+                f.write('\n10000')
+            with open(path) as f:
+                self.assertRaises(MyriaError, self.connection.upload_file,
+                                  self.RELATION_KEY, self.SCHEMA, f,
+                                  chunk_size=4096, parallelism=1,
+                                  manifest=manifest)
+            self.assertRaises(MyriaError, self.connection.upload_file,
+                              self.RELATION_KEY, self.SCHEMA, self.DATA,
+                              chunk_size=4096, manifest=manifest)
+        self.assertEquals(self.uploads, 2)
+        self.assertEquals(self.plans, [])
+
+
+class TestCompression(unittest.TestCase):
+    def setUp(self):
+        self.requests = []
+
+        @urlmatch(netloc=r'localhost:12345')
+        def compressed_mock(url, request):
+            body = request.body
+            if not isinstance(body, basestring):
+                body = ''.join(body)
+            self.requests.append((request.headers, body))
+            return json.dumps({'relationKey': TestUpload.RELATION_KEY})
+
+        self.mock = compressed_mock
+        self.connection = MyriaConnection(hostname='localhost', port=12345,
+                                          compression='gzip')
+
+    def decompress(self, body):
+        return zlib.decompress(body, 16 + zlib.MAX_WBITS)
+
+    def test_upload(self):
+        with HTTMock(self.mock):
+            self.connection.upload_file(TestUpload.RELATION_KEY,
+                                        TestUpload.SCHEMA, TestUpload.DATA)
+        headers, body = self.requests[0]
+        self.assertEquals(headers['Content-Encoding'], 'gzip')
+        self.assertIn(TestUpload.DATA, self.decompress(body))
+
+        stats = self.connection.transfer_stats
+        self.assertEquals(stats['sent'], len(self.decompress(body)))
+        self.assertEquals(stats['sent_compressed'], len(body))
+        self.assertLess(stats['sent_compressed'], stats['sent'])
+
+    def test_plan(self):
+        plan = {'rawQuery': 'x' * 10000, 'fragments': []}
+        with HTTMock(self.mock):
+            self.connection._request('POST', '/query', data=json.dumps(plan))
+            self.connection._request('POST', '/query', data='{}')
+        headers, body = self.requests[0]
+        self.assertEquals(headers['Content-Encoding'], 'gzip')
+        self.assertEquals(json.loads(self.decompress(body)), plan)
+        # Small bodies are not worth compressing
+        headers, body = self.requests[1]
+        self.assertNotIn('Content-Encoding', headers)
+        self.assertEquals(body, '{}')
+
+    def test_uncompressed(self):
+        connection = MyriaConnection(hostname='localhost', port=12345)
+        with HTTMock(self.mock):
+            connection._request('POST', '/query', data='x' * 5000)
+        self.assertNotIn('Content-Encoding', self.requests[0][0])
+        self.assertEquals(connection.transfer_stats['sent'], 5000)
+        self.assertEquals(connection.transfer_stats['sent_compressed'], 5000)
+
+    def test_unsupported(self):
+        self.assertRaises(ValueError, MyriaConnection, hostname='localhost',
+                          port=12345, compression='zstd')
+
+    def test_decompress(self):
+        data = json.dumps([[i] for i in xrange(10000)])
+        counts = []
+        chunks = list(_compress((data[i:i + 1000]
+                                 for i in xrange(0, len(data), 1000)),
+                                lambda *count: None))
+        decoded = _decompress(chunks, 'gzip',
+                              lambda *count: counts.append(count))
+        self.assertEquals(''.join(decoded), data)
+        self.assertEquals(sum(size for size, _ in counts), len(data))
+        self.assertEquals(sum(size for _, size in counts),
+                          len(''.join(chunks)))
+
+        self.assertEquals(''.join(_decompress(['ab', 'c'], '',
+                                              lambda *count: None)), 'abc')
+        self.assertRaises(requests.exceptions.ContentDecodingError, list,
+                          _decompress(['not gzip'], 'gzip',
+                                      lambda *count: None))
+
+
+class TestMetadataCache(unittest.TestCase):
+    RELATION_KEY = {'userName': 'public',
+                    'programName': 'adhoc',
+                    'relationName': 'r'}
+
+    def setUp(self):
+        self.fetches = []
+
+        @urlmatch(netloc=r'localhost:12345')
+        def metadata_mock(url, request):
+            if request.method == 'GET':
+                self.fetches.append(url.path)
+                return json.dumps({'relationKey': self.RELATION_KEY,
+                                   'numTuples': len(self.fetches)})
+            return json.dumps({'queryId': 5})
+
+        self.mock = metadata_mock
+        self.connection = MyriaConnection(hostname='localhost', port=12345)
+
+    def test_hit(self):
+        with HTTMock(self.mock):
+            first = self.connection.dataset(self.RELATION_KEY)
+            first['numTuples'] = -1
+            second = self.connection.dataset(self.RELATION_KEY)
+        self.assertEquals(len(self.fetches), 1)
+        self.assertEquals(second['numTuples'], 1)
+        self.assertEquals(self.connection.cache_stats,
+                          {'hits': 1, 'misses': 1, 'size': 1})
+
+    def test_expiry(self):
+        self.connection.metadata_ttl = 0.01
+        with HTTMock(self.mock):
+            self.connection.dataset(self.RELATION_KEY)
+            time.sleep(0.02)
+            self.assertEquals(
+                self.connection.dataset(self.RELATION_KEY)['numTuples'], 2)
+
+    def test_disabled(self):
+        self.connection.metadata_ttl = None
+        with HTTMock(self.mock):
+            self.connection.dataset(self.RELATION_KEY)
+            self.connection.dataset(self.RELATION_KEY)
+        self.assertEquals(len(self.fetches), 2)
+        self.assertEquals(self.connection.cache_stats['size'], 0)
+
+    def test_invalidate_on_delete(self):
+        with HTTMock(self.mock):
+            self.connection.dataset(self.RELATION_KEY)
+            version = self.connection.catalog_version
+            self.connection.delete_dataset(self.RELATION_KEY)
+            self.connection.dataset(self.RELATION_KEY)
+        self.assertEquals(len(self.fetches), 2)
+        self.assertGreater(self.connection.catalog_version, version)
+
+    def test_invalidate_on_upload(self):
+        with HTTMock(self.mock):
+            self.connection.dataset(self.RELATION_KEY)
+            self.connection.create_empty(self.RELATION_KEY,
+                                         TestUpload.SCHEMA)
+            self.connection.dataset(self.RELATION_KEY)
+        self.assertEquals(len(self.fetches), 2)
+
+
+class TestAsyncConnection(unittest.TestCase):
+    RELATION_KEY = {'userName': 'public',
+                    'programName': 'adhoc',
+                    'relationName': 'r'}
+
+    def test_methods(self):
+        with HTTMock(local_mock):
+            connection = MyriaAsyncConnection(hostname='localhost',
+                                              port=12345)
+            results = [connection.workers() for _ in xrange(10)]
+            for result in results:
+                self.assertEquals(result.get(),
+                                  {'1': 'localhost:12347',
+                                   '2': 'localhost:12348'})
+            self.assertEquals(
+                connection.download_dataset(self.RELATION_KEY).get(),
+                [[i] for i in xrange(10)])
+
+    def test_stream(self):
+        with HTTMock(local_mock):
+            connection = MyriaAsyncConnection(
+                MyriaConnection(hostname='localhost', port=12345))
+            batches = list(connection.stream_dataset(self.RELATION_KEY,
+                                                     batch_size=4,
+                                                     prefetch=1))
+            self.assertEquals(batches, [[[0], [1], [2], [3]],
+                                        [[4], [5], [6], [7]],
+                                        [[8], [9]]])
+
+            bad_key = dict(self.RELATION_KEY, relationName='bad')
+            with self.assertRaises(MyriaError):
+                list(connection.stream_dataset(bad_key))
+
+    def test_abandoned_stream(self):
+        pool = ThreadPool(2)
+        with HTTMock(local_mock):
+            connection = MyriaAsyncConnection(
+                MyriaConnection(hostname='localhost', port=12345), pool=pool)
+            for _ in xrange(3):
+                batches = connection.stream_dataset(self.RELATION_KEY,
+                                                    batch_size=1,
+                                                    prefetch=1)
+                next(batches)
+                batches.close()
+            for _ in xrange(3):
+                next(connection.stream_dataset(self.RELATION_KEY,
+                                               batch_size=1, prefetch=1))
+
+            # The abandoned downloads released their threads
+            self.assertEquals(
+                connection.submit(lambda: 'done').get(timeout=5), 'done')
+        pool.terminate()
+
+
+class TestStreamingDecode(unittest.TestCase):
+    VALUES = [{'a': 1, 'b': u'x,y]'}, {'a': 12345, 'b': u'\u00e9'},
+              {'a': -2.5, 'b': None}]
+
+    def chunked(self, size):
+        text = json.dumps(self.VALUES)
+        return [text[i:i + size] for i in xrange(0, len(text), size)]
+
+    def test_single_chunk(self):
+        self.assertEqual(list(_iter_json_array(self.chunked(1000))),
+                         self.VALUES)
+
+    def test_small_chunks(self):
+        for size in xrange(1, 8):
+            self.assertEqual(list(_iter_json_array(self.chunked(size))),
+                             self.VALUES)
+
+    def test_numbers_split_across_chunks(self):
+        self.assertEqual(list(_iter_json_array(['[1', '23, 4', '5]'])),
+                         [123, 45])
+
+    def test_empty(self):
+        self.assertEqual(list(_iter_json_array([' [ ', ' ]'])), [])
+
+    def test_truncated(self):
+        with self.assertRaises(ValueError):
+            list(_iter_json_array(['[1, 2, {"a": ']))
+
+    def test_not_an_array(self):
+        with self.assertRaises(ValueError):
+            list(_iter_json_array(['{"a": 1}']))
+
+
+@unittest.skipIf(numpy is None, 'NumPy is not installed')
+class TestCSVArray(unittest.TestCase):
+    NAMES = ['a', 'b']
+    DATA = 'a,b\n1,0.5\n-2,1e3\n3,-4.25\n'
+
+    def setUp(self):
+        self.dtype = numpy.dtype([('a', 'int64'), ('b', 'float64')])
+
+    def parse(self, data, chunk_size):
+        return _parse_csv_array(
+            [data[i:i + chunk_size] for i in xrange(0, len(data), chunk_size)],
+            self.NAMES, self.dtype)
+
+    def test_parse(self):
+        for chunk_size in [1, 3, 1000]:
+            array = self.parse(self.DATA, chunk_size)
+            self.assertEquals(array.dtype, self.dtype)
+            self.assertEquals(array['a'].tolist(), [1, -2, 3])
+            self.assertEquals(array['b'].tolist(), [0.5, 1000.0, -4.25])
+
+    def test_no_header(self):
+        array = self.parse(self.DATA.split('\n', 1)[1], 4)
+        self.assertEquals(array['a'].tolist(), [1, -2, 3])
+
+    def test_large_integers(self):
+        array = self.parse('a,b\n9007199254740993,0\n', 5)
+        self.assertEquals(array['a'].tolist(), [9007199254740993])
+
+    def test_empty(self):
+        for data in ['', 'a,b\n']:
+            self.assertEquals(len(self.parse(data, 2)), 0)
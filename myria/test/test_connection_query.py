@@ -75,8 +75,11 @@ class TestQuery(unittest.TestCase):
     def test_execute(self):
         q = query()
         with HTTMock(local_mock):
+            polls = self.connection.polling.stats['polls']
             status = self.connection.execute_query(q)
             self.assertEquals(status, query_status(q))
+            self.assertEquals(self.connection.polling.stats['polls'],
+                              polls + 3)
 
     def test_compile_plan(self):
         with HTTMock(create_mock()):
@@ -1,13 +1,17 @@
+from datetime import datetime, timedelta
 import unittest
 import json
 
-from httmock import HTTMock
+from httmock import HTTMock, urlmatch
 from myria import MyriaSchema
 from myria.connection import MyriaConnection
+from myria.fluent import MyriaFluentQuery, _unique_name
 from myria.relation import MyriaRelation
 from myria.test.mock import create_mock, FULL_NAME, FULL_NAME2, UDF1_ARITY, \
-    UDF1_TYPE, SCHEMA
-from myria.udf import myria_function
+    UDF1_NAME, UDF1_TYPE, SCHEMA
+from myria.udf import myria_function, MyriaPythonFunction
+from raco import compile
+from raco.compile import optimize as raco_optimize
 from raco.algebra import CrossProduct, Join, ProjectingJoin, Apply, Select
 from raco.expression import UnnamedAttributeRef, TAUTOLOGY, COUNTALL, COUNT, \
     PYUDF
@@ -43,7 +47,7 @@ class TestFluent(unittest.TestCase):
 
             relation.execute()
             plan = state['query']
-            text = json.dumps(plan['plan']['fragments'][0]['operators'][0])
+            text = json.dumps(plan['plan']['fragments'][1]['operators'][0])
             self.assertTrue('FileScan' in text)
             self.assertTrue('TupleSource' in text)
             self.assertTrue(url in text)
@@ -271,6 +275,168 @@ class TestFluent(unittest.TestCase):
                                  [COUNT(UnnamedAttributeRef(1))])
             self.assertIsNotNone(count._sink().to_json())
 
+    def test_shared_context(self):
+        with HTTMock(create_mock()):
+            relation = MyriaRelation(FULL_NAME, connection=self.connection)
+
+        # Deriving queries makes no requests (which would fail here)
+        query = relation.select('column').distinct().limit(5).count()
+        self.assertIs(query.context, relation.context)
+        self.assertIs(query.parent.parent.context, relation.context)
+
+        other = MyriaConnection(hostname='localhost', port=12346)
+        self.assertIsNot(MyriaFluentQuery(query, query.query, other).context,
+                         relation.context)
+
+    def test_plan_cache(self):
+        with HTTMock(create_mock()):
+            relation = MyriaRelation(FULL_NAME, connection=self.connection)
+            query = relation.where(lambda t: t.column < 5).count('column')
+        tree = repr(query.query)
+        compilations = []
+
+        def optimize(expr, target, **kwargs):
+            compilations.append(target)
+            return raco_optimize(expr, target, **kwargs)
+
+        compile.optimize = optimize
+        try:
+            plan = query._sink().to_json()
+            plan['rawQuery'] = 'modified'
+            self.assertEqual(len(compilations), 2)
+            self.assertEqual(query._sink().to_json()['rawQuery'],
+                             'Sink[%s]' % query)
+            self.assertEqual(len(compilations), 2)
+            self.assertEqual(repr(query.query), tree)
+
+            # Changes to the catalog invalidate compiled plans
+            self.connection.invalidate_metadata()
+            query._sink().to_json()
+            self.assertEqual(len(compilations), 4)
+        finally:
+            compile.optimize = raco_optimize
+
+    def result_mock(self, created, deleted=None, state=None, listing=()):
+        @urlmatch(netloc=r'localhost:12345', path=r'/dataset.*')
+        def mock(url, request):
+            if request.method == 'DELETE':
+                deleted.append((url.path, 'query' in (state or {})))
+                return {'status_code': 200, 'content': ''}
+            elif url.path == '/dataset':
+                return json.dumps([
+                    {'relationKey': {'userName': user,
+                                     'programName': 'adhoc',
+                                     'relationName': name},
+                     'numTuples': 10,
+                     'created': str(datetime.now() - timedelta(seconds=age))}
+                    for user, name, age in [
+                        ('public', 'relation', 0),
+                        ('public', 'result_' + 'a' * 32, 30),
+                        ('public', 'result_' + 'b' * 32, 10),
+                        ('public', 'result_' + 'c' * 32, 20),
+                        ('public', 'result_final', 40),
+                        ('other', 'result_' + 'd' * 32, 50)] +
+                    list(listing)])
+            elif 'relation-result_' in url.path:
+                return json.dumps({'queryId': 123, 'created': str(created)})
+        return mock
+
+    def test_reuse_result(self):
+        state = {}
+        with HTTMock(self.result_mock(datetime.now()), create_mock(state)):
+            relation = MyriaRelation(FULL_NAME, connection=self.connection)
+            query = relation.where(lambda t: t.column < 5).execute(reuse=True)
+            self.assertEqual(query.query_id, 123)
+            self.assertNotIn('query', state)
+
+    def test_reuse_stale_result(self):
+        state = {}
+        with HTTMock(self.result_mock(datetime(1800, 1, 1)),
+                     create_mock(state)):
+            relation = MyriaRelation(FULL_NAME, connection=self.connection)
+            query = relation.where(lambda t: t.column < 5).execute(reuse=True)
+            self.assertEqual(query.query_id, 999)
+            self.assertIn('query', state)
+
+    def test_reuse_overwritten_input(self):
+        state = {}
+        with HTTMock(self.result_mock(datetime(1850, 1, 1)),
+                     create_mock(state)):
+            relation = MyriaRelation(FULL_NAME, connection=self.connection)
+            # The cached metadata predates the input being overwritten
+            metadata = self.connection.dataset(relation.qualified_name)
+            metadata['created'] = str(datetime(1800, 1, 1))
+            self.connection.cache_metadata(relation.qualified_name, metadata)
+
+            query = relation.where(lambda t: t.column < 5).execute(reuse=True)
+            self.assertEqual(query.query_id, 999)
+            self.assertIn('query', state)
+
+    def test_result_name_udf(self):
+        with HTTMock(create_mock()):
+            relation = MyriaRelation(FULL_NAME, connection=self.connection)
+            udf1 = id
+            query = relation.select(lambda t: udf1(t[0]))
+            name = query._result_name()
+            self.assertNotEqual(name, _unique_name(query.query))
+
+        @urlmatch(netloc=r'localhost:12345', path='/function/' + UDF1_NAME)
+        def replaced_mock(url, request):
+            return json.dumps(MyriaPythonFunction(
+                lambda i: 1, UDF1_TYPE, UDF1_NAME, False).to_dict())
+
+        # Registering the function anew with different code changes the
+        # name of the result
+        with HTTMock(replaced_mock, create_mock()):
+            self.assertNotEqual(query._result_name(), name)
+
+    def test_overwrite_stale_result(self):
+        state, deleted = {}, []
+        with HTTMock(create_mock()):
+            relation = MyriaRelation(FULL_NAME, connection=self.connection)
+        query = relation.where(lambda t: t.column < 5)
+        query.ResultMaxAge = 15
+        name = _unique_name(query.query)
+        mock = self.result_mock(datetime(1800, 1, 1), deleted, state,
+                                [('public', name, 100)])
+
+        with HTTMock(mock, create_mock(state)):
+            self.assertEqual(query.execute(reuse=True).query_id, 999)
+
+        # Older results are evicted before the query is submitted, except
+        # the stale result that the query overwrites
+        self.assertEqual(sorted(deleted), [
+            ('/dataset/user-public/program-adhoc/relation-result_' + 'a' * 32,
+             False),
+            ('/dataset/user-public/program-adhoc/relation-result_' + 'c' * 32,
+             False)])
+
+    def test_evict_results(self):
+        deleted = []
+        with HTTMock(self.result_mock(None, deleted)):
+            evicted = MyriaFluentQuery.evict_results(self.connection,
+                                                     max_count=2)
+            self.assertEqual([key['relationName'] for key in evicted],
+                             ['result_' + 'a' * 32])
+
+            evicted = MyriaFluentQuery.evict_results(self.connection,
+                                                     max_age=15)
+            self.assertEqual([key['relationName'] for key in evicted],
+                             ['result_' + 'c' * 32, 'result_' + 'a' * 32])
+
+            evicted = MyriaFluentQuery.evict_results(self.connection,
+                                                     max_tuples=15)
+            self.assertEqual(len(evicted), 2)
+
+            # Only the results of the given user and program are deleted
+            evicted = MyriaFluentQuery.evict_results(self.connection,
+                                                     max_count=0,
+                                                     user='other')
+            self.assertEqual([key['relationName'] for key in evicted],
+                             ['result_' + 'd' * 32])
+        self.assertEqual(len(deleted), 6)
+        self.assertFalse(any('result_final' in path for path, _ in deleted))
+
     def test_python_registered_udf(self):
         with HTTMock(create_mock()):
             relation = MyriaRelation(FULL_NAME, connection=self.connection)
@@ -307,6 +473,17 @@ class TestFluent(unittest.TestCase):
             self.assertEqual([n.get_val() for n in pyudf.arguments],
                              SCHEMA['columnNames'])
 
+    def test_python_udf_reused(self):
+        server_state = {}
+        with HTTMock(create_mock(server_state)):
+            relation = MyriaRelation(FULL_NAME, connection=self.connection)
+            names = [relation.select(lambda t: eval("1 < 2")).query
+                     .emitters[0][1].name.value for _ in xrange(2)]
+
+            self.assertEqual(names[0], names[1])
+            self.assertTrue(names[0].startswith('udf_'))
+            self.assertEqual(server_state.keys(), names[:1])
+
     def test_python_udf_predicate(self):
         with HTTMock(create_mock()):
             relation = MyriaRelation(FULL_NAME, connection=self.connection)
@@ -1,3 +1,6 @@
+import os
+import shutil
+import tempfile
 import unittest
 import myria.plans
 from myria.schema import MyriaSchema
@@ -59,3 +62,216 @@ class TestPlans(unittest.TestCase):
 
             self.assertEquals(insert_operator['opType'], insert_type)
             self.assertEquals(insert_operator['metadata'], 'bar')
+
+    def test_partition_plan(self):
+        partitions = [(0, {'userName': 'public',
+                           'programName': 'adhoc',
+                           'relationName': 'partition0'}),
+                      (1, {'userName': 'public',
+                           'programName': 'adhoc',
+                           'relationName': 'partition1'})]
+        plan = myria.plans.get_partition_plan(QUALIFIED_NAME, partitions)
+
+        self.assertEquals(len(plan['fragments']), len(partitions))
+        for (worker, partition), fragment in zip(partitions,
+                                                 plan['fragments']):
+            scan, insert = fragment['operators']
+            self.assertEquals(fragment['overrideWorkers'], [worker])
+            self.assertEquals(scan['relationKey'], QUALIFIED_NAME)
+            self.assertEquals(insert['relationKey'], partition)
+            self.assertEquals(insert['argChild'], scan['opId'])
+
+    def test_union_plan(self):
+        sources = [dict(QUALIFIED_NAME, relationName='part{}'.format(i))
+                   for i in range(3)]
+        plan = myria.plans.get_union_plan(sources, QUALIFIED_NAME,
+                                          overwrite=False)
+
+        self.assertEquals(len(plan['fragments']), 1)
+        operators = plan['fragments'][0]['operators']
+        scans, union, insert = operators[:-2], operators[-2], operators[-1]
+        self.assertEquals([scan['relationKey'] for scan in scans], sources)
+        self.assertEquals(union['argChildren'],
+                          [scan['opId'] for scan in scans])
+        self.assertEquals(insert['argChild'], union['opId'])
+        self.assertEquals(insert['relationKey'], QUALIFIED_NAME)
+        self.assertFalse(insert['argOverwriteTable'])
+
+    def test_pack_work(self):
+        work = [(1, {'uri': 'a'}), (2, {'uri': 'b'}), (3, {'uri': 'c'}),
+                (1, {'uri': 'd'}), (2, {'uri': 'e'})]
+        sizes = [10, 70, 30, 20, 40]
+        assignments, loads = myria.plans.pack_work(work, sizes)
+
+        self.assertEquals(loads, {1: 70, 2: 50, 3: 50})
+        self.assertEquals(assignments,
+                          [(1, [{'uri': 'b'}]),
+                           (2, [{'uri': 'e'}, {'uri': 'a'}]),
+                           (3, [{'uri': 'c'}, {'uri': 'd'}])])
+
+    def test_pack_unknown_sizes(self):
+        work = [(1, {'uri': 'a'}), (2, {'uri': 'b'}), (1, {'uri': 'c'})]
+        _, loads = myria.plans.pack_work(work, [100, None, 50])
+        # b counts as the average known size
+        self.assertEquals(loads, {1: 100, 2: 125})
+
+    def test_balanced_plan(self):
+        work = [(0, {'uri': 'a'}), (1, {'uri': 'b'}), (0, {'uri': 'c'})]
+        plan = myria.plans.get_parallel_import_plan(
+            SCHEMA, work, QUALIFIED_NAME, text='Import',
+            balance=True, sizes=[5, 10, 4])
+
+        self.assertIn('0=10, 1=9', plan['rawQuery'])
+        fragments = dict((fragment['overrideWorkers'][0],
+                          fragment['operators'])
+                         for fragment in plan['fragments'])
+        scans = [op['source'] for op in fragments[1]
+                 if op['opType'] == 'TupleSource']
+        self.assertEquals(scans, [{'uri': 'a'}, {'uri': 'c'}])
+        self.assertEquals(fragments[1][2]['opType'], 'UnionAll')
+        self.assertEquals(fragments[1][2]['argChildren'],
+                          [op['opId'] for op in fragments[1][:2]])
+        self.assertEquals(len(fragments[0]), 2)
+        self.assertEquals(fragments[0][0]['reader']['schema'],
+                          SCHEMA.to_dict())
+
+    def test_distribute_function(self):
+        self.assertEquals(
+            myria.plans.get_distribute_function(SCHEMA, ['column']),
+            {'type': 'Hash', 'indexes': [0]})
+        self.assertEquals(
+            myria.plans.get_distribute_function(SCHEMA, [0], 'Identity'),
+            {'type': 'Identity', 'index': 0})
+        self.assertRaises(ValueError, myria.plans.get_distribute_function,
+                          SCHEMA, [0], 'Broadcast')
+        self.assertRaises(ValueError, myria.plans.get_distribute_function,
+                          SCHEMA, ['nosuchcolumn'])
+
+    def test_partitioned_import(self):
+        partitioning = {'type': 'Hash', 'indexes': [0]}
+        plan = myria.plans.get_parallel_import_plan(
+            SCHEMA, WORK, QUALIFIED_NAME, partitioning=partitioning)
+
+        fragments = plan['fragments']
+        self.assertEquals(len(fragments), len(WORK) + 1)
+        producers = []
+        for (worker, _), fragment in zip(WORK, fragments):
+            scan, producer = fragment['operators']
+            self.assertEquals(fragment['overrideWorkers'], [worker])
+            self.assertEquals(producer['opType'], 'ShuffleProducer')
+            self.assertEquals(producer['argChild'], scan['opId'])
+            self.assertEquals(producer['distributeFunction'], partitioning)
+            producers.append(producer['opId'])
+
+        # The tuples are stored wherever they are shuffled to
+        consumers, union, insert = (fragments[-1]['operators'][:-2],
+                                    fragments[-1]['operators'][-2],
+                                    fragments[-1]['operators'][-1])
+        self.assertNotIn('overrideWorkers', fragments[-1])
+        self.assertEquals([consumer['argOperatorId']
+                           for consumer in consumers], producers)
+        self.assertEquals(union['argChildren'],
+                          [consumer['opId'] for consumer in consumers])
+        self.assertEquals(insert['argChild'], union['opId'])
+        self.assertEquals(insert['relationKey'], QUALIFIED_NAME)
+        self.assertEquals(insert['distributeFunction'], partitioning)
+
+        ids = [op['opId'] for fragment in fragments
+               for op in fragment['operators']]
+        self.assertEquals(len(ids), len(set(ids)))
+
+        self.assertRaises(ValueError, myria.plans.get_parallel_import_plan,
+                          SCHEMA, [], QUALIFIED_NAME,
+                          partitioning=partitioning)
+
+
+class TestSplitInputs(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.uris = []
+        self.data = []
+        for i, rows in enumerate([1000, 10, 3000]):
+            path = os.path.join(self.directory, 'input{}.csv'.format(i))
+            data = ''.join('{},{}\n'.format(i, j * 7919) for j in range(rows))
+            with open(path, 'w') as f:
+                f.write(data)
+            self.uris.append('file://' + path)
+            self.data.append(data)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def read(self, uri, start, end):
+        return self.data[self.uris.index(uri)][start:end]
+
+    def test_input_size(self):
+        self.assertEquals(myria.plans.get_input_size(self.uris[0]),
+                          len(self.data[0]))
+        self.assertIsNone(myria.plans.get_input_size(self.uris[0] + 'x'))
+        self.assertIsNone(myria.plans.get_input_size('hdfs://host/path'))
+
+    def test_record_boundary(self):
+        data = self.data[0]
+        for offset in [1, 5, 100, len(data) - 1]:
+            boundary = myria.plans.find_record_boundary(
+                self.uris[0], offset, len(data))
+            self.assertGreaterEqual(boundary, offset)
+            self.assertEquals(data[boundary - 1], '\n')
+            self.assertNotIn('\n', data[offset:boundary - 1])
+        line = data.index('\n') + 1
+        self.assertEquals(myria.plans.find_record_boundary(
+            self.uris[0], line, len(data)), line)
+
+    def test_split(self):
+        workers = [1, 2, 3, 4]
+        assignments = myria.plans.split_inputs(self.uris, workers)
+
+        self.assertEquals([worker for worker, _ in assignments], workers)
+        ranges = [range_ for _, assigned in assignments
+                  for range_ in assigned]
+        # The ranges cover every input, in order, and end with a record
+        self.assertEquals(''.join(self.read(*range_) for range_ in ranges),
+                          ''.join(self.data))
+        for range_ in ranges:
+            self.assertTrue(self.read(*range_).endswith('\n'))
+
+        loads = [sum(end - start for _, start, end in assigned)
+                 for _, assigned in assignments]
+        share = sum(len(data) for data in self.data) / len(workers)
+        for load in loads:
+            self.assertLess(abs(load - share), 20)
+
+    def test_unknown_size(self):
+        uris = self.uris + ['hdfs://host/path']
+        sizes = [len(data) for data in self.data] + [None]
+        assignments = myria.plans.split_inputs(uris, [1, 2], sizes=sizes)
+        ranges = [range_ for _, assigned in assignments
+                  for range_ in assigned]
+        self.assertIn(('hdfs://host/path', 0, None), ranges)
+
+    def test_range_plan(self):
+        assignments = [(1, [('file:///a', 0, 10), ('file:///b', 0, 5)]),
+                       (2, [('file:///b', 5, 20)])]
+        plan = myria.plans.get_range_import_plan(
+            SCHEMA, assignments, QUALIFIED_NAME,
+            scan_type={'readerType': 'CSV', 'skip': 1})
+
+        first, second = plan['fragments']
+        self.assertEquals(first['overrideWorkers'], [1])
+        scans, union, insert = (first['operators'][:2],
+                                first['operators'][2],
+                                first['operators'][3])
+        self.assertEquals(union['opType'], 'UnionAll')
+        self.assertEquals(union['argChildren'],
+                          [scan['opId'] for scan in scans])
+        self.assertEquals(insert['argChild'], union['opId'])
+        self.assertEquals(scans[1]['source'],
+                          {'dataType': 'URI', 'uri': 'file:///b',
+                           'startRange': 0, 'endRange': 5})
+        self.assertEquals(scans[1]['reader']['skip'], 1)
+
+        scan, insert = second['operators']
+        self.assertEquals(insert['argChild'], scan['opId'])
+        # Only the start of an input has a header to skip
+        self.assertNotIn('skip', scan['reader'])
+        self.assertEquals(scan['reader']['schema'], SCHEMA.to_dict())
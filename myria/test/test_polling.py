@@ -0,0 +1,47 @@
+import time
+import unittest
+from email.utils import formatdate
+from itertools import islice
+from myria.polling import PollingStrategy, _parse_retry_after
+
+
+class TestPolling(unittest.TestCase):
+    def test_backoff(self):
+        strategy = PollingStrategy(initial=1, multiplier=2, maximum=5,
+                                   jitter=0)
+        self.assertListEqual(list(islice(strategy.delays(), 5)),
+                             [1, 2, 4, 5, 5])
+
+    def test_jitter(self):
+        strategy = PollingStrategy(initial=1, multiplier=1, jitter=0.5)
+        for delay in islice(strategy.delays(), 100):
+            self.assertTrue(0.5 <= delay <= 1.5)
+
+    def test_stats(self):
+        strategy = PollingStrategy(initial=0.01, multiplier=2, jitter=0)
+        poller = strategy.start()
+        poller.wait()
+        poller.wait()
+        poller.finish()
+
+        self.assertEqual(strategy.stats['polls'], 2)
+        self.assertAlmostEqual(strategy.stats['wait_time'], 0.03)
+        self.assertAlmostEqual(strategy.stats['wasted_time'], 0.02)
+
+    def test_deadline(self):
+        strategy = PollingStrategy(initial=10, jitter=0)
+        start = time.time()
+        strategy.start().wait(deadline=start + 0.01)
+        self.assertLess(time.time() - start, 1)
+
+    def test_retry_after(self):
+        self.assertEqual(_parse_retry_after('3', 1), 3)
+        self.assertEqual(_parse_retry_after('-3', 1), 0)
+        self.assertEqual(_parse_retry_after('garbage', 1), 1)
+        delay = _parse_retry_after(formatdate(time.time() + 60), 1)
+        self.assertTrue(55 <= delay <= 60)
+
+        strategy = PollingStrategy(initial=10, jitter=0)
+        start = time.time()
+        strategy.start().wait(retry_after='0')
+        self.assertLess(time.time() - start, 1)
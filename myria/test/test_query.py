@@ -25,6 +25,9 @@ QUERY_TIME = datetime(1900, 1, 2, 3, 4)
 TUPLES = [[1], [2], [3], [4], [5]]
 
 
+LISTINGS = []
+PLANS = []
+
 STATE_SUCCESS = 'Unittest-Success'
 STATE_RUNNING = 'RUNNING'
 
@@ -80,8 +83,22 @@ def local_mock(url, request):
         body = str(TUPLES[:int(limit if limit else len(TUPLES))])
         return {'status_code': 200, 'content': body}
 
+    # Query listing
+    elif url.path == '/query' and request.method == 'GET':
+        LISTINGS.append(request.original.params)
+        return {'status_code': 200,
+                'content': {'results': [
+                    query_status(RAW_QUERY, query_id=RUNNING_QUERY_ID,
+                                 status=STATE_RUNNING),
+                    query_status(RAW_QUERY, query_id=COMPLETED_QUERY_ID,
+                                 status=STATE_SUCCESS)]}}
+
+    elif url.path == '/workers/alive':
+        return {'status_code': 200, 'content': [1, 2]}
+
     # Query submission
     elif url.path == '/query':
+        PLANS.append(json.loads(request.body))
         if 'RUN_FOREVER' in request.body:
             return {'status_code': 202,
                     'content': '',
@@ -231,3 +248,107 @@ class TestQuery(unittest.TestCase):
 
             query = MyriaQuery.parallel_import(relation, work)
             self.assertEquals(query.status, 'Unittest-Success')
+
+    def test_partitioned_import(self):
+        with HTTMock(local_mock):
+            schema = MyriaSchema({'columnNames': ['column'],
+                                  'columnTypes': ['INT_TYPE']})
+            relation = MyriaRelation(FULL_NAME,
+                                     schema=schema,
+                                     connection=self.connection)
+            work = [(0, 'http://input-uri-0'), (1, 'http://input-uri-1')]
+            del PLANS[:]
+
+            query = MyriaQuery.parallel_import(relation, work,
+                                               partition_by=['column'])
+            self.assertEquals(query.status, 'Unittest-Success')
+            insert = PLANS[0]['fragments'][-1]['operators'][-1]
+            self.assertEquals(insert['distributeFunction'],
+                              {'type': 'Hash', 'indexes': [0]})
+
+    def test_parallel_import_files(self):
+        with HTTMock(local_mock):
+            schema = MyriaSchema({'columnNames': ['column'],
+                                  'columnTypes': ['INT_TYPE']})
+            relation = MyriaRelation(FULL_NAME,
+                                     schema=schema,
+                                     connection=self.connection)
+            del PLANS[:]
+
+            query = MyriaQuery.parallel_import_files(
+                relation, ['hdfs://input-0', 'hdfs://input-1',
+                           'hdfs://input-2'])
+            self.assertEquals(query.status, 'Unittest-Success')
+            self.assertEquals(
+                sorted(fragment['overrideWorkers'][0]
+                       for fragment in PLANS[0]['fragments']), [1, 2])
+            # Inputs are read whole unless they are explicitly split
+            self.assertNotIn('startRange', json.dumps(PLANS[0]))
+
+            MyriaQuery.parallel_import_files(
+                relation, ['hdfs://input-0', 'hdfs://input-1'], split=True)
+            self.assertEquals(
+                sorted(fragment['overrideWorkers'][0]
+                       for fragment in PLANS[1]['fragments']), [1, 2])
+
+    def test_metadata_cache(self):
+        with HTTMock(local_mock):
+            relation = MyriaRelation(FULL_NAME, connection=self.connection)
+            self.assertEqual(len(relation), len(TUPLES))
+            MyriaRelation(FULL_NAME, connection=self.connection).schema
+            self.assertEqual(self.connection.cache_stats['misses'], 1)
+
+            # A completed query replaces the metadata of its output
+            query = MyriaQuery(COMPLETED_QUERY_ID, connection=self.connection,
+                               wait_for_completion=True)
+            self.assertEqual(query.name, FULL_NAME)
+            self.assertEqual(len(relation), 1)
+            self.assertEqual(self.connection.cache_stats['misses'], 1)
+
+            # Later accesses do not list or invalidate the metadata again
+            version = self.connection.catalog_version
+            query.name, query.qualified_name, query.components
+            query.to_dict()
+            self.assertEqual(self.connection.catalog_version, version)
+            self.assertEqual(len(relation), 1)
+            self.assertEqual(self.connection.cache_stats['misses'], 1)
+
+    def test_as_completed(self):
+        with HTTMock(local_mock):
+            completed = MyriaQuery(COMPLETED_QUERY_ID,
+                                   connection=self.connection)
+            running = MyriaQuery(RUNNING_QUERY_ID,
+                                 connection=self.connection)
+            del LISTINGS[:]
+
+            queries = MyriaQuery.as_completed([running, completed],
+                                              timeout=1)
+            self.assertEqual(next(queries), completed)
+            self.assertEqual(completed.name, FULL_NAME)
+            self.assertRaises(requests.Timeout, next, queries)
+
+            # Once one query remains, it is polled individually
+            self.assertEqual(len(LISTINGS), 1)
+            self.assertEqual(int(LISTINGS[0]['max']), RUNNING_QUERY_ID)
+            self.assertEqual(int(LISTINGS[0]['limit']), 2)
+
+    def test_wait_all(self):
+        with HTTMock(local_mock):
+            queries = [MyriaQuery(COMPLETED_QUERY_ID,
+                                  connection=self.connection),
+                       MyriaQuery(QUERY_ID, connection=self.connection)]
+            self.assertEqual(MyriaQuery.wait_all(queries), queries)
+            self.assertEqual(queries[0].status, STATE_SUCCESS)
+            self.assertEqual(MyriaQuery.wait_all([]), [])
+
+    def test_async(self):
+        with HTTMock(local_mock):
+            query = MyriaQuery(COMPLETED_QUERY_ID, connection=self.connection)
+            self.assertEqual(query.wait_for_completion_async().get(), query)
+            self.assertEqual(query.to_dict_async().get(), TUPLES)
+
+            query = MyriaQuery(RUNNING_QUERY_ID,
+                               connection=self.connection,
+                               timeout=1)
+            self.assertRaises(requests.Timeout,
+                              query.wait_for_completion_async().get)
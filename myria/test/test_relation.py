@@ -1,8 +1,11 @@
 from httmock import urlmatch, HTTMock
 from datetime import datetime
+import json
 import unittest
-from myria.connection import MyriaConnection
-from myria.relation import MyriaRelation
+from myria.connection import MyriaConnection, numpy
+from myria.errors import MyriaError
+from myria.relation import MyriaRelation, DataFrame, _to_dataframe, \
+    DATAFRAME_BATCH_SIZE
 from myria.schema import MyriaSchema
 
 
@@ -35,7 +38,12 @@ def local_mock(url, request):
     # Relation download
     if url.path == get_uri(RELATION_NAME) + '/data':
         limit = request.original.params.get('limit', None)
-        body = str(TUPLES[:int(limit) if limit else len(TUPLES)])
+        tuples = TUPLES[:int(limit) if limit else len(TUPLES)]
+        if request.original.params.get('format') == 'csv':
+            lines = [','.join(map(str, t)) for t in tuples]
+            body = '\n'.join([','.join(SCHEMA['columnNames'])] + lines)
+        else:
+            body = str(tuples)
         return {'status_code': 200, 'content': body}
 
     # Relation not found in database
@@ -48,6 +56,44 @@ def local_mock(url, request):
     return None
 
 
+PARTITIONS = {1: [[1], [2]], 2: [[3]], 3: []}
+
+
+def create_partition_mock(state):
+    @urlmatch(netloc=r'localhost:12345')
+    def partition_mock(url, request):
+        partition_uri = get_uri(RELATION_NAME + '__partition_')
+        if url.path == '/workers/alive':
+            return {'status_code': 200, 'content': PARTITIONS.keys()}
+        elif url.path == '/query' and request.method == 'POST':
+            state['plan'] = json.loads(request.body)
+            return {'status_code': 201,
+                    'headers': {'Location': '/query/query-7'},
+                    'content': {'queryId': 7}}
+        elif url.path == '/query/query-7':
+            return {'status_code': 200,
+                    'content': {'queryId': 7,
+                                'status': state.get('status', 'SUCCESS')}}
+        elif url.path == '/dataset':
+            return {'status_code': 200, 'content': []}
+        elif url.path.startswith(partition_uri) and \
+                request.method == 'DELETE':
+            state.setdefault('deleted', []).append(url.path)
+            if state.get('status') == 'ERROR':
+                return {'status_code': 404, 'content': 'Not found'}
+            return {'status_code': 200, 'content': ''}
+        elif url.path.startswith(partition_uri) and \
+                url.path.endswith('/data'):
+            token, worker = url.path[len(partition_uri):-len('/data')] \
+                .split('_')
+            state.setdefault('tokens', set()).add(token)
+            worker = int(worker)
+            return {'status_code': 200,
+                    'content': json.dumps(PARTITIONS[worker])}
+        return None
+    return partition_mock
+
+
 class TestRelation(unittest.TestCase):
     def __init__(self, args):
         with HTTMock(local_mock):
@@ -156,3 +202,133 @@ class TestRelation(unittest.TestCase):
                                           'columnTypes': ['INT_TYPE']}))
 
             self.assertEquals(relation.to_dict(), [])
+
+    def test_iterator_download(self):
+        with HTTMock(local_mock):
+            relation = MyriaRelation(FULL_NAME, connection=self.connection)
+
+            self.assertListEqual(list(relation.to_iterator()), TUPLES)
+            self.assertListEqual(list(relation.to_iterator(limit=2)),
+                                 TUPLES[:2])
+            self.assertListEqual(list(relation.to_iterator(batch_size=2)),
+                                 [TUPLES[:2], TUPLES[2:4], TUPLES[4:]])
+
+    @unittest.skipIf(DataFrame is None, 'Pandas is not installed')
+    def test_dataframe_download(self):
+        with HTTMock(local_mock):
+            relation = MyriaRelation(FULL_NAME, connection=self.connection)
+            dataframe = relation.to_dataframe()
+
+            self.assertListEqual(list(dataframe.columns),
+                                 SCHEMA['columnNames'])
+            self.assertEqual(str(dataframe['column'].dtype), 'int32')
+            self.assertListEqual(dataframe['column'].tolist(),
+                                 [t[0] for t in TUPLES])
+            self.assertEqual(len(relation.to_dataframe(limit=2)), 2)
+
+    @unittest.skipIf(DataFrame is None, 'Pandas is not installed')
+    def test_typed_columns(self):
+        schema = MyriaSchema({'columnNames': ['i', 'd', 's', 't', 'b'],
+                              'columnTypes': ['LONG_TYPE', 'DOUBLE_TYPE',
+                                              'STRING_TYPE', 'DATETIME_TYPE',
+                                              'BOOLEAN_TYPE']})
+        tuples = [{'i': 1, 'd': 0.5, 's': 'a', 't': '2016-01-02T03:04:05Z',
+                   'b': True},
+                  {'i': None, 'd': None, 's': 'b',
+                   't': '2017-01-02T03:04:05Z', 'b': None}]
+        # An undersized estimate grows the preallocated columns
+        dataframe = _to_dataframe(iter(tuples), schema, size=1,
+                                  categorical=True)
+
+        self.assertListEqual(list(dataframe.columns), schema.names)
+        self.assertEqual(str(dataframe['i'].dtype), 'float64')
+        self.assertEqual(str(dataframe['d'].dtype), 'float64')
+        self.assertEqual(str(dataframe['s'].dtype), 'category')
+        self.assertTrue(str(dataframe['t'].dtype).startswith('datetime64'))
+        self.assertEqual(dataframe['b'].tolist(), [True, None])
+        self.assertEqual(dataframe['i'][0], 1)
+        self.assertEqual(dataframe['t'][1].year, 2017)
+
+        dataframe = _to_dataframe(iter(tuples[:1]), schema, size=1, index='s')
+        self.assertEqual(str(dataframe['i'].dtype), 'int64')
+        self.assertListEqual(list(dataframe.index), ['a'])
+
+    @unittest.skipIf(DataFrame is None, 'Pandas is not installed')
+    def test_null_in_later_batch(self):
+        schema = MyriaSchema({'columnNames': ['i', 's'],
+                              'columnTypes': ['INT_TYPE', 'STRING_TYPE']})
+        size = DATAFRAME_BATCH_SIZE + 2
+        tuples = [[i, str(i)] for i in xrange(size - 1)] + [[None, None]]
+        dataframe = _to_dataframe(iter(tuples), schema)
+
+        self.assertEqual(len(dataframe), size)
+        self.assertEqual(str(dataframe['i'].dtype), 'float64')
+        self.assertEqual(dataframe['i'][size - 2], size - 2)
+        self.assertTrue(numpy.isnan(dataframe['i'][size - 1]))
+        self.assertEqual(dataframe['s'][size - 2], str(size - 2))
+
+    @unittest.skipIf(numpy is None, 'NumPy is not installed')
+    def test_array_download(self):
+        with HTTMock(local_mock):
+            relation = MyriaRelation(FULL_NAME, connection=self.connection)
+            array = relation.to_array()
+
+            self.assertEqual(array.dtype.names, ('column',))
+            self.assertEqual(str(array.dtype['column']), 'int32')
+            self.assertListEqual(array['column'].tolist(),
+                                 [t[0] for t in TUPLES])
+            self.assertEqual(len(relation.to_array(limit=1)), 1)
+
+    @unittest.skipIf(numpy is None, 'NumPy is not installed')
+    def test_nonnumeric_array_download(self):
+        with HTTMock(local_mock):
+            self.assertRaises(MyriaError,
+                              self.connection.download_array,
+                              QUALIFIED_NAME,
+                              {'columnNames': ['column'],
+                               'columnTypes': ['STRING_TYPE']})
+
+    def test_parallel_download(self):
+        state = {}
+        with HTTMock(create_partition_mock(state), local_mock):
+            relation = MyriaRelation(FULL_NAME, connection=self.connection)
+            tuples = list(relation.to_iterator(parallelism=2))
+
+            self.assertListEqual(tuples, [[1], [2], [3]])
+            self.assertEqual(len(state['plan']['fragments']),
+                             len(PARTITIONS))
+            self.assertEqual(len(state['deleted']), len(PARTITIONS))
+            for worker, fragment in zip(sorted(PARTITIONS),
+                                        state['plan']['fragments']):
+                self.assertEqual(fragment['overrideWorkers'], [worker])
+                self.assertEqual(fragment['operators'][0]['relationKey'],
+                                 QUALIFIED_NAME)
+
+            self.assertListEqual(
+                list(relation.to_iterator(limit=2, batch_size=1,
+                                          parallelism=3)),
+                [[[1]], [[2]]])
+
+            # Each download copies its partitions under a distinct name
+            self.assertEqual(len(state['tokens']), 2)
+
+    def test_failed_partitioning(self):
+        state = {'status': 'ERROR'}
+        with HTTMock(create_partition_mock(state), local_mock):
+            relation = MyriaRelation(FULL_NAME, connection=self.connection)
+            with self.assertRaises(MyriaError) as context:
+                list(relation.to_iterator(parallelism=2))
+
+            self.assertIn('ERROR', str(context.exception))
+            # Every partition is deleted, even those never created
+            self.assertEqual(len(state['deleted']), len(PARTITIONS))
+
+    def test_abandoned_parallel_download(self):
+        state = {}
+        with HTTMock(create_partition_mock(state), local_mock):
+            relation = MyriaRelation(FULL_NAME, connection=self.connection)
+            tuples = relation._download_partitions(parallelism=1)
+            self.assertEqual(next(tuples), [1])
+            tuples.close()
+
+            self.assertEqual(len(state['deleted']), len(PARTITIONS))
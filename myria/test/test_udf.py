@@ -1,7 +1,9 @@
 import unittest
+from threading import Event
 
-from httmock import HTTMock
-from myria.connection import MyriaConnection
+from httmock import HTTMock, urlmatch
+from myria.connection import MyriaConnection, DEFAULT_CONCURRENCY, \
+    _get_default_pool
 from myria.test.mock import *
 from myria.udf import MyriaFunction, MyriaPostgresFunction, myria_function
 from raco.backends.myria.connection import FunctionTypes
@@ -108,3 +110,71 @@ class TestUDF(unittest.TestCase):
             d = MyriaPythonFunction.from_dict(server_state[name]).to_dict()
             self.assertEqual(d['name'], name)
             self.assertEqual(d['outputType'], STRING_TYPE)
+
+    def test_lazy_body(self):
+        d = MyriaPythonFunction(lambda t: 0, LONG_TYPE, 'lazy').to_dict()
+        d['source'] = 'undefined_name'
+        f = MyriaPythonFunction.from_dict(d, self.connection)
+
+        self.assertEqual(f.name, 'lazy')
+        self.assertEqual(f.to_dict()['binary'], d['binary'])
+        self.assertRaises(NameError, lambda: f.body)
+
+    def test_listing_details(self):
+        fetched = []
+        listing = [MyriaPostgresFunction('f', 'source', STRING_TYPE).to_dict(),
+                   UDF1_NAME, UDF2_NAME]
+
+        @urlmatch(netloc=r'localhost:12345', path=r'/function/.*')
+        def fetch_mock(url, request):
+            fetched.append(url.path)
+            return None
+
+        with HTTMock(fetch_mock, create_mock()):
+            details = MyriaFunction._get_details(self.connection, listing)
+
+        self.assertEqual(sorted(fetched),
+                         ['/function/' + UDF1_NAME, '/function/' + UDF2_NAME])
+        self.assertEqual([d['name'] for d in details],
+                         ['f', UDF1_NAME, UDF2_NAME])
+
+    def test_listing_details_busy_pool(self):
+        # Fetching details must not wait for the shared asynchronous pool
+        release = Event()
+        pool = _get_default_pool()
+        blockers = [pool.apply_async(release.wait)
+                    for _ in xrange(DEFAULT_CONCURRENCY)]
+        try:
+            with HTTMock(create_mock()):
+                details = MyriaFunction._get_details(self.connection,
+                                                     [UDF1_NAME])
+            self.assertEqual([d['name'] for d in details], [UDF1_NAME])
+        finally:
+            release.set()
+            for blocker in blockers:
+                blocker.get()
+
+    def test_register_unchanged(self):
+        server_state = {}
+        stats = MyriaFunction.registration_stats()
+
+        with HTTMock(create_mock(server_state)):
+            for output_type in [STRING_TYPE, STRING_TYPE, LONG_TYPE]:
+                MyriaPythonFunction(lambda t: 0, output_type, 'dedup',
+                                    connection=self.connection).register()
+            # A function deleted from the server is uploaded again
+            server_state.pop('dedup')
+            MyriaPythonFunction(lambda t: 0, LONG_TYPE, 'dedup',
+                                connection=self.connection).register()
+            MyriaPythonFunction(lambda t: 1, LONG_TYPE, 'dedup',
+                                connection=self.connection).register()
+
+        self.assertEqual(server_state.keys(), ['dedup'])
+        self.assertEqual(
+            MyriaFunction.registration_stats()['uploaded'] - stats['uploaded'],
+            4)
+        self.assertEqual(
+            MyriaFunction.registration_stats()['skipped'] - stats['skipped'],
+            1)
+        self.assertEqual(MyriaFunction.get('dedup', self.connection).body(0),
+                         1)
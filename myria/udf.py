@@ -1,13 +1,19 @@
 """Creating User Defined functions"""
 import re
 import base64
-from itertools import imap
+import hashlib
+import json
+from multiprocessing.pool import ThreadPool
+from threading import Lock
 
 from raco.backends.myria.connection import FunctionTypes
+from raco.myrial.parser import Parser
 from raco.python.exceptions import PythonConvertException
 from raco.python.util.decompile import get_source
 from raco.types import STRING_TYPE
 
+from myria.connection import DEFAULT_CONCURRENCY
+from myria.errors import MyriaError
 from myria.utility import cloudpickle
 
 
@@ -36,6 +42,8 @@ def myria_function(name=None, output_type=STRING_TYPE, multivalued=False,
 
 class MyriaFunction(object):
     _cache = {}
+    _stats_lock = Lock()
+    _stats = {'uploaded': 0, 'skipped': 0}
 
     @classmethod
     def get_all(cls, connection=None):
@@ -43,14 +51,41 @@ class MyriaFunction(object):
         connection = connection or MyriaRelation.DefaultConnection
         if connection.execution_url not in cls._cache:
             cls._cache[connection.execution_url] = [
-                MyriaPythonFunction.from_dict(udf, connection)
-                if udf['lang'] == FunctionTypes.PYTHON else
-                MyriaPostgresFunction.from_dict(udf, connection)
-                for udf in imap(connection.get_function,
-                                connection.get_functions())]
+                cls._load(udf, connection)
+                for udf in cls._get_details(connection,
+                                            connection.get_functions())]
 
         return cls._cache[connection.execution_url]
 
+    @staticmethod
+    def _load(udf, connection):
+        """ The function described by its Myria metadata """
+        if udf['lang'] == FunctionTypes.PYTHON:
+            return MyriaPythonFunction.from_dict(udf, connection)
+        return MyriaPostgresFunction.from_dict(udf, connection)
+
+    @staticmethod
+    def _get_details(connection, listing):
+        """ Fetch the metadata of each function named in a listing
+            concurrently, unless the listing already includes it """
+        names = [udf for udf in listing if isinstance(udf, basestring)]
+        # A private pool, so that this never waits behind (or blocks) work
+        # on the pool shared by asynchronous connections
+        pool = ThreadPool(min(max(len(names), 1), DEFAULT_CONCURRENCY))
+        try:
+            details = iter(pool.map(connection.get_function, names))
+        finally:
+            pool.terminate()
+        return [next(details) if isinstance(udf, basestring) else udf
+                for udf in listing]
+
+    @classmethod
+    def registration_stats(cls):
+        """ The number of registrations that uploaded a function, and the
+            number skipped because an identical function was registered """
+        with cls._stats_lock:
+            return dict(cls._stats)
+
     @classmethod
     def get(cls, name, connection=None):
         from myria import MyriaRelation
@@ -67,11 +102,58 @@ class MyriaFunction(object):
         self.multivalued = multivalued
         self.language = language
 
+    @property
+    def fingerprint(self):
+        """ A hash of the type and content of this function, excluding its
+            name """
+        return hashlib.sha1(json.dumps(
+            [self.language, str(self.output_type), bool(self.multivalued),
+             self._content()])).hexdigest()
+
+    def _content(self):
+        return self.source
+
     def register(self):
+        """ Register this function with Myria, unless a function with the
+            same name and fingerprint is already registered there """
         from myria import MyriaRelation
         connection = self.connection or MyriaRelation.DefaultConnection
-        self.get_all(connection).append(self)
+        functions = self.get_all(connection)
+        existing = next((i for i, f in enumerate(functions)
+                         if f.name == self.name), None)
+        if existing is not None and \
+                functions[existing].fingerprint == self.fingerprint and \
+                self._is_registered(connection):
+            self._record('skipped')
+            if self.name not in Parser.udf_functions:
+                # Make the function known to MyriaL, as raco does on upload
+                options = dict((key, value)
+                               for key, value in self.to_dict().items()
+                               if key not in ('name', 'outputType'))
+                Parser.add_python_udf(self.name, self.output_type,
+                                      overwrite_if_exists=True, **options)
+            return
+
+        if existing is not None:
+            functions[existing] = self
+        else:
+            functions.append(self)
         connection.create_function(self.to_dict())
+        self._record('uploaded')
+
+    def _is_registered(self, connection):
+        """ Whether Myria still has this function; the cached listing may
+            be stale if it was since deleted or replaced """
+        try:
+            udf = connection.get_function(self.name)
+        except MyriaError:
+            return False
+        return self._load(udf, connection).fingerprint == self.fingerprint
+
+    @classmethod
+    def _record(cls, outcome):
+        with cls._stats_lock:
+            cls._stats[outcome] += 1
 
     def to_dict(self):
         return {'name': self.name,
@@ -102,12 +184,27 @@ class MyriaPostgresFunction(MyriaFunction):
 class MyriaPythonFunction(MyriaFunction):
     def __init__(self, body, output_type=STRING_TYPE, name=None,
                  multivalued=False, connection=None):
-        self.body = body
-        self.binary = base64.urlsafe_b64encode(cloudpickle.dumps(body, 2))
+        self._body = body
+        self._binary = None
         super(MyriaPythonFunction, self).__init__(
             self._get_name(name, body), self._get_source(body), output_type,
             FunctionTypes.PYTHON, multivalued, connection)
 
+    @property
+    def body(self):
+        return self._body
+
+    @property
+    def binary(self):
+        """ The pickled body, which is only serialized when first needed """
+        if self._binary is None:
+            self._binary = base64.urlsafe_b64encode(
+                cloudpickle.dumps(self.body, 2))
+        return self._binary
+
+    def _content(self):
+        return self.binary
+
     def to_dict(self):
         d = super(MyriaPythonFunction, self).to_dict()
         d['binary'] = self.binary
@@ -134,9 +231,25 @@ class MyriaPythonFunction(MyriaFunction):
     @staticmethod
     def from_dict(d, connection=None):
         from myria import MyriaRelation
-        return MyriaPythonFunction(
-            eval(d.get('source', "0")),
-            d['outputType'],
-            d['name'],
-            bool(d.get('isMultiValued', False)),
-            connection=connection or MyriaRelation.DefaultConnection)
+        return _StoredPythonFunction(
+            d, connection=connection or MyriaRelation.DefaultConnection)
+
+
+class _StoredPythonFunction(MyriaPythonFunction):
+    """ A Python function loaded from its Myria metadata. Its body is only
+        evaluated when used, and its stored binary is reused as is. """
+
+    def __init__(self, d, connection=None):
+        MyriaFunction.__init__(
+            self, d['name'], d.get('description'), d['outputType'],
+            FunctionTypes.PYTHON, bool(d.get('isMultiValued', False)),
+            connection)
+        self._source = d.get('source', "0")
+        self._body = None
+        self._binary = d.get('binary')
+
+    @property
+    def body(self):
+        if self._body is None:
+            self._body = eval(self._source)
+        return self._body